@@ -1,7 +1,6 @@
+import datetime
 import streamlit as st
-import utils
-import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 
 st.set_page_config(
     page_title="MPT Analyzer",
@@ -88,12 +87,14 @@ with col1:
 with col2:
     # A quick look at a random vibrant chart
     st.markdown("### Market Pulse (Demo)")
-    df_demo = pd.DataFrame({
-        'Date': pd.date_range(start='2024-01-01', periods=100),
-        'Price': pd.Series(range(100)) + pd.Series(range(100)).apply(lambda x: x * 0.1 + (x%10))
-    })
-    fig = px.line(df_demo, x='Date', y='Price', template="plotly_dark")
+    # Plain lists and graph_objects keep the landing page free of the pandas/plotly.express import cost
+    dates = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(100)]
+    prices = [x + x * 0.1 + (x % 10) for x in range(100)]
+    fig = go.Figure(go.Scatter(x=dates, y=prices, mode='lines'))
     fig.update_layout(
+        template="plotly_dark",
+        xaxis_title='Date',
+        yaxis_title='Price',
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
         xaxis=dict(showgrid=False),
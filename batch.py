@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import utils
+
+def load_ticker_file(path):
+    """
+    Reads a custom universe: tickers separated by commas and/or whitespace, '#' starts a comment.
+    """
+    tickers = []
+    with open(path) as f:
+        for line in f:
+            tickers += [t.strip().upper() for t in re.split(r"[,\s]+", line.split("#")[0]) if t.strip()]
+    return list(dict.fromkeys(tickers))
+
+def build_jobs(universes, periods=("5y",), risk_free_rates=(0.02,), frontier_points=50, n_factors=None,
+               dtype="float64"):
+    """
+    One job per (universe, period). All risk free rates of a universe are solved in the same job
+    (see utils.batch_optimize). The job id hashes the parameters, so changing any of them
+    produces a new job instead of reusing a stale result.
+    """
+    jobs = []
+    for name, tickers in universes.items():
+        for period in periods:
+            job = {"universe": name, "tickers": sorted(set(tickers)), "period": period,
+                   "risk_free_rates": sorted(float(rf) for rf in risk_free_rates),
+                   "frontier_points": frontier_points, "n_factors": n_factors, "dtype": dtype}
+            digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()[:10]
+            job["job_id"] = f"{re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')}-{period}-{digest}"
+            jobs.append(job)
+    return jobs
+
+def run_job(job):
+    """
+    The page pipeline for one job: fetch -> metrics -> optimize -> frontier line.
+    """
+    start = time.perf_counter()
+    prices = utils.fetch_stock_data(job["tickers"], period=job["period"], how="all")
+    if prices.shape[1] < 2:
+        return {**job, "status": "skipped", "reason": "fewer than 2 tickers with data",
+                "seconds": time.perf_counter() - start}
+
+    daily_returns = utils.ReturnsMatrix.from_prices(prices, dtype=job["dtype"], how="all")
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns, n_factors=job["n_factors"])
+    portfolios = utils.batch_optimize(mean_ret, cov_matrix, job["risk_free_rates"]).drop(columns="subset")
+    ef_returns, ef_volatilities = utils.calculate_efficient_frontier_line(mean_ret, cov_matrix,
+                                                                          num_points=job["frontier_points"])
+    return {
+        **job,
+        "status": "ok",
+        "assets": list(prices.columns),
+        "missing": sorted(set(job["tickers"]) - set(prices.columns)),
+        "start": str(prices.index[0].date()),
+        "end": str(prices.index[-1].date()),
+        "mean_returns": mean_ret.to_dict(),
+        "volatilities": dict(zip(mean_ret.index, np.sqrt(np.diagonal(np.asarray(cov_matrix))))),
+        "portfolios": portfolios.to_dict(orient="records"),
+        "frontier": {"returns": list(ef_returns), "volatilities": list(ef_volatilities)},
+        "seconds": time.perf_counter() - start,
+    }
+
+def _result_path(output_dir, job):
+    return os.path.join(output_dir, f"{job['job_id']}.json")
+
+def _write_json(path, payload):
+    # Write-then-rename, so an interrupted run never leaves a half written result behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f, default=float)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def run_batch(jobs, output_dir="batch_results", max_workers=None, force=False):
+    """
+    Runs the jobs over a process pool and writes one JSON result per job to output_dir.
+    Jobs whose result already exists are skipped (unless force), so an interrupted run can simply
+    be restarted. Prices for all pending jobs are fetched once up front, in batches, to fill the
+    shared on-disk price cache before the workers start. Failed jobs are reported and not
+    written, so the next run retries them. Returns a status DataFrame.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    statuses = [{"job_id": job["job_id"], "status": "done", "seconds": 0.0}
+                for job in jobs if not force and os.path.exists(_result_path(output_dir, job))]
+    pending = [job for job in jobs if force or not os.path.exists(_result_path(output_dir, job))]
+    print(f"{len(jobs)} jobs: {len(statuses)} already done, {len(pending)} to run")
+
+    for period in dict.fromkeys(job["period"] for job in pending):
+        tickers = sorted({t for job in pending if job["period"] == period for t in job["tickers"]})
+        utils.fetch_stock_data(tickers, period=period)
+
+    def record(job, result=None, error=None):
+        if error is None:
+            _write_json(_result_path(output_dir, job), result)
+            status = {"job_id": job["job_id"], "status": result["status"], "seconds": result["seconds"]}
+        else:
+            status = {"job_id": job["job_id"], "status": "failed", "seconds": np.nan, "error": repr(error)}
+        statuses.append(status)
+        print(f"{status['status']:<8} {job['job_id']}" + (f"  {status['error']}" if error else ""))
+
+    if max_workers == 1:
+        for job in pending:
+            try:
+                record(job, run_job(job))
+            except Exception as e:
+                record(job, error=e)
+    elif pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(run_job, job): job for job in pending}
+            for future in as_completed(futures):
+                try:
+                    record(futures[future], future.result())
+                except Exception as e:
+                    record(futures[future], error=e)
+    return pd.DataFrame(statuses)
+
+def collect_results(jobs, output_dir="batch_results"):
+    """
+    Flattens the stored job results into two tidy tables: portfolio metrics with one row per
+    (universe, period, risk_free_rate, portfolio), and weights with one row per ticker as well.
+    """
+    metric_rows, weight_rows = [], []
+    for job in jobs:
+        path = _result_path(output_dir, job)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            result = json.load(f)
+        if result["status"] != "ok":
+            continue
+        for p in result["portfolios"]:
+            keys = {"universe": result["universe"], "period": result["period"],
+                    "risk_free_rate": p["risk_free_rate"], "portfolio": p["portfolio"]}
+            metric_rows.append({**keys, "return": p["return"], "volatility": p["volatility"],
+                                "sharpe": p["sharpe"]})
+            weight_rows += [{**keys, "ticker": t, "weight": p[t]} for t in result["assets"]]
+    return pd.DataFrame(metric_rows), pd.DataFrame(weight_rows)
+
+def write_tables(tables, output_dir="batch_results", fmt="json"):
+    """
+    Writes the tables from collect_results as JSON records or Parquet (needs pyarrow or fastparquet).
+    """
+    paths = []
+    for name, table in tables.items():
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        if fmt == "parquet":
+            table.to_parquet(path, index=False)
+        else:
+            table.to_json(path, orient="records", indent=1)
+        paths.append(path)
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the optimizer pipeline for many universes.")
+    parser.add_argument("--sectors", nargs="*",
+                        help="Sectors of the built-in stock universe to run (default: all of them)")
+    parser.add_argument("--no-sectors", action="store_true", help="Skip the built-in sectors")
+    parser.add_argument("--all", action="store_true", help="Also run the whole built-in universe as one job")
+    parser.add_argument("--ticker-files", nargs="*", default=[],
+                        help="Custom universes, one ticker file each (named after the file)")
+    parser.add_argument("--periods", nargs="+", default=["5y"])
+    parser.add_argument("--risk-free-rates", nargs="+", type=float, default=[0.02])
+    parser.add_argument("--frontier-points", type=int, default=50)
+    parser.add_argument("--factors", type=int, help="Use a factor model covariance with this many factors")
+    parser.add_argument("--float32", action="store_true", help="Hold daily returns in float32 to halve memory")
+    parser.add_argument("--workers", type=int, help="Worker processes (1 runs in process)")
+    parser.add_argument("--output-dir", default="batch_results")
+    parser.add_argument("--format", choices=["json", "parquet"], default="json")
+    parser.add_argument("--force", action="store_true", help="Rerun jobs that already have results")
+    args = parser.parse_args(argv)
+
+    stock_universe = utils.get_stock_universe()
+    universes = {}
+    if not args.no_sectors:
+        for sector in args.sectors or stock_universe:
+            if sector not in stock_universe:
+                parser.error(f"Unknown sector: {sector}")
+            universes[sector] = stock_universe[sector]
+    if args.all:
+        universes["All"] = [t for tickers in stock_universe.values() for t in tickers]
+    for path in args.ticker_files:
+        universes[os.path.splitext(os.path.basename(path))[0]] = load_ticker_file(path)
+    if not universes:
+        parser.error("No universes selected.")
+
+    jobs = build_jobs(universes, args.periods, args.risk_free_rates, args.frontier_points, args.factors,
+                      "float32" if args.float32 else "float64")
+    statuses = run_batch(jobs, args.output_dir, args.workers, args.force)
+    metrics, weights = collect_results(jobs, args.output_dir)
+    for path in write_tables({"portfolios": metrics, "weights": weights}, args.output_dir, args.format):
+        print(f"Wrote {path}")
+    return 1 if (statuses["status"] == "failed").any() else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import constrained
+import risk
+import utils
+
+def synthetic_returns(n_assets, n_days, structure="factor", n_factors=3, correlation=0.3, seed=0):
+    """
+    Synthetic daily returns with a known correlation structure, so benchmarks never touch the network.
+    structure="factor": k-factor model; "constant": equal pairwise correlation; "independent": none.
+    """
+    rng = np.random.default_rng(seed)
+    drift = rng.normal(0.0004, 0.0003, n_assets)
+    vol = rng.uniform(0.01, 0.025, n_assets)
+    if structure == "factor":
+        loadings = rng.normal(0, 1, (n_assets, n_factors))
+        common = rng.standard_normal((n_days, n_factors)) @ loadings.T
+        common /= np.sqrt(np.sum(loadings**2, axis=1))
+        shocks = 0.6 * common + 0.8 * rng.standard_normal((n_days, n_assets))
+    elif structure == "constant":
+        market = rng.standard_normal((n_days, 1))
+        shocks = np.sqrt(correlation) * market + np.sqrt(1 - correlation) * rng.standard_normal((n_days, n_assets))
+    elif structure == "independent":
+        shocks = rng.standard_normal((n_days, n_assets))
+    else:
+        raise ValueError(f"Unknown correlation structure: {structure}")
+    index = pd.bdate_range("2000-01-03", periods=n_days)
+    return pd.DataFrame(drift + vol * shocks, index=index, columns=[f"S{i:04d}" for i in range(n_assets)])
+
+def synthetic_prices(n_assets, n_days, **kwargs):
+    returns = synthetic_returns(n_assets, n_days, **kwargs)
+    return 100 * (1 + returns).cumprod()
+
+def measure(func, repeat=3):
+    """
+    Runs func `repeat` times and returns (result, best wall time in seconds, peak traced MB).
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak / 1024**2
+
+# Each case takes (prices, returns, mean, cov) and returns its solver iteration count, if any
+
+def _daily_returns(prices, returns, mean, cov):
+    utils.calculate_daily_returns(prices)
+
+def _annualized_metrics(prices, returns, mean, cov):
+    utils.calculate_annualized_metrics(returns)
+
+def _annualized_metrics_float32(prices, returns, mean, cov):
+    utils.calculate_annualized_metrics(utils.ReturnsMatrix.from_prices(prices, dtype=np.float32))
+
+def _optimize(prices, returns, mean, cov):
+    return sum(result.nit for result in utils.optimize_portfolio(mean, cov))
+
+def _optimize_factor(prices, returns, mean, cov):
+    factor_cov = utils.FactorCovariance.from_returns(returns, n_factors=10)
+    return sum(result.nit for result in utils.optimize_portfolio(mean, factor_cov))
+
+def _frontier_simulation(prices, returns, mean, cov):
+    utils.generate_efficient_frontier(mean, cov, num_portfolios=20000, return_weights=False)
+
+def _frontier_line_cla(prices, returns, mean, cov):
+    return len(utils.CriticalLineAlgorithm(mean, cov).weights)
+
+def _frontier_line_slsqp(prices, returns, mean, cov):
+    return utils._frontier_line_slsqp(mean, cov, 50, mode="warm")[2]
+
+def _historical_var_cvar(prices, returns, mean, cov):
+    _, weights = utils.generate_efficient_frontier(mean, cov, num_portfolios=20000)
+    risk.historical_var_cvar(weights, returns)
+
+def _minimize_cvar(prices, returns, mean, cov):
+    return risk.minimize_cvar(returns).nit
+
+def _optimize_constrained(prices, returns, mean, cov):
+    # Every asset and sector capped, with a turnover limit against equal weights
+    sectors = {f"Sector {k}": list(mean.index[k::10]) for k in range(10)}
+    return constrained.optimize_constrained(mean, cov, asset_bounds=(0.0, 0.05), sectors=sectors,
+                                            sector_bounds={s: (None, 0.2) for s in sectors},
+                                            current_weights=np.full(len(mean), 1 / len(mean)), max_turnover=1.0).nit
+
+# name -> (largest n_assets to run it for, case)
+CASES = {
+    "calculate_daily_returns": (None, _daily_returns),
+    "calculate_annualized_metrics": (None, _annualized_metrics),
+    "calculate_annualized_metrics_float32": (None, _annualized_metrics_float32),
+    "optimize_portfolio": (500, _optimize),
+    "optimize_portfolio_factor": (None, _optimize_factor),
+    "generate_efficient_frontier": (None, _frontier_simulation),
+    "calculate_efficient_frontier_line": (200, _frontier_line_cla),
+    "calculate_efficient_frontier_line_slsqp": (50, _frontier_line_slsqp),
+    "historical_var_cvar": (None, _historical_var_cvar),
+    "minimize_cvar": (500, _minimize_cvar),
+    "optimize_constrained": (500, _optimize_constrained),
+}
+
+def run_suite(sizes, structure="factor", repeat=3, cases=None):
+    rows = []
+    for n_assets, n_days in sizes:
+        prices = synthetic_prices(n_assets, n_days + 1, structure=structure)
+        returns = utils.calculate_daily_returns(prices)
+        mean, cov = utils.calculate_annualized_metrics(returns)
+        for name, (max_assets, case) in CASES.items():
+            if (cases and name not in cases) or (max_assets is not None and n_assets > max_assets):
+                continue
+            iterations, seconds, peak_mb = measure(lambda: case(prices, returns, mean, cov), repeat)
+            rows.append({"case": name, "n_assets": n_assets, "n_days": n_days, "seconds": seconds,
+                         "peak_mb": peak_mb, "iterations": iterations})
+            print(f"{name:<42} {n_assets:>5} x {n_days:<5} {seconds * 1000:10.1f} ms {peak_mb:9.1f} MB"
+                  f"  iters={iterations}")
+    return rows
+
+def compare(rows, baseline_rows, tolerance=1.25):
+    """
+    Returns the cases whose wall time or peak memory exceeds the baseline by more than `tolerance`x.
+    """
+    baseline = {(b["case"], b["n_assets"], b["n_days"]): b for b in baseline_rows}
+    regressions = []
+    for row in rows:
+        base = baseline.get((row["case"], row["n_assets"], row["n_days"]))
+        if base is None:
+            continue
+        for metric in ("seconds", "peak_mb"):
+            # Ignore noise on tiny measurements
+            floor = 0.002 if metric == "seconds" else 1.0
+            if row[metric] > tolerance * max(base[metric], floor):
+                regressions.append({**row, "metric": metric, "baseline": base[metric],
+                                    "ratio": row[metric] / max(base[metric], floor)})
+    return regressions
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in size.split("x")) for size in text.split(",")]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the utils math and optimization hot paths.")
+    parser.add_argument("--sizes", default="5x250,50x1250,200x2500,500x5000,2000x5000",
+                        help="Comma separated ASSETSxDAYS problem sizes")
+    parser.add_argument("--structure", default="factor", choices=["factor", "constant", "independent"])
+    parser.add_argument("--cases", nargs="*", help="Only run these cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Baseline results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    rows = run_suite(parse_sizes(args.sizes), args.structure, args.repeat, args.cases)
+    report = {"created": pd.Timestamp.now().isoformat(), "python": platform.python_version(),
+              "numpy": np.__version__, "machine": platform.machine(), "results": rows}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(rows)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f)["results"], args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} {r['n_assets']}x{r['n_days']} {r['metric']}: "
+                  f"{r['baseline']:.4g} -> {r[r['metric']]:.4g} ({r['ratio']:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import utils
+
+# Roughly two points per horizontal pixel of a wide chart; more can't be seen, only shipped
+MAX_LINE_POINTS = 2000
+# Above this many simulated portfolios the frontier cloud is binned instead of drawn point by point
+MAX_SCATTER_POINTS = 20000
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: the rows of (x, y) to keep so n_out points preserve the visual
+    shape of the series (peaks, troughs and trends). y may be 2-D (one column per series); each
+    column is downsampled independently and the result has shape (n_out, n_series).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ys = y.reshape(len(y), -1)
+    n, k = ys.shape
+    if n_out >= n or n_out < 3:
+        keep = np.repeat(np.arange(n)[:, None], k, axis=1)
+        return keep if y.ndim == 2 else keep[:, 0]
+
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty((n_out, k), dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    cols = np.arange(k)
+    a = np.zeros(k, dtype=int)
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[hi:next_hi].mean(), ys[hi:next_hi].mean(axis=0)
+        # Twice the area of the triangle (previous kept point, candidate, next bucket average)
+        area = np.abs((x[a] - next_x) * (ys[lo:hi] - ys[a, cols])
+                      - (x[a] - x[lo:hi, None]) * (next_y - ys[a, cols]))
+        a = lo + np.argmax(area, axis=0)
+        keep[i + 1] = a
+    return keep if y.ndim == 2 else keep[:, 0]
+
+def line_figure(df, max_points=MAX_LINE_POINTS, **layout):
+    """
+    WebGL line chart of every column of a time indexed frame, each downsampled with LTTB to at
+    most max_points points.
+    """
+    x = df.index.values.astype("datetime64[ns]").astype(np.int64) if isinstance(df.index, pd.DatetimeIndex) \
+        else np.arange(len(df))
+    values = df.to_numpy(dtype=float)
+    if np.isnan(values).any():
+        # Series with different histories (e.g. a recent listing) are downsampled one at a time
+        rows = [np.flatnonzero(~np.isnan(values[:, j])) for j in range(values.shape[1])]
+        keeps = [r[lttb_indices(x[r], values[r, j], max_points)] for j, r in enumerate(rows)]
+    else:
+        keep = lttb_indices(x, values, max_points)
+        keeps = [keep[:, j] for j in range(values.shape[1])]
+    fig = go.Figure([go.Scattergl(x=df.index[k], y=values[k, j], mode="lines", name=str(col))
+                     for j, (col, k) in enumerate(zip(df.columns, keeps))])
+    fig.update_layout(**layout)
+    utils.annotate_span(points=int(np.sum(~np.isnan(values))), shipped_points=int(sum(len(k) for k in keeps)))
+    return fig
+
+def frontier_cloud_trace(volatility, returns, sharpe, max_points=MAX_SCATTER_POINTS, bins=80):
+    """
+    Trace for the simulated portfolio cloud: WebGL markers up to max_points portfolios, above that
+    a binned density where each cell is colored by the mean Sharpe ratio of its portfolios.
+    """
+    volatility, returns, sharpe = (np.asarray(v, dtype=float) for v in (volatility, returns, sharpe))
+    colorbar = dict(title="Sharpe Ratio")
+    if len(volatility) <= max_points:
+        utils.annotate_span(points=len(volatility), shipped_points=len(volatility))
+        return go.Scattergl(x=volatility, y=returns, mode="markers", name="Simulated Portfolios",
+                            marker=dict(color=sharpe, colorscale="Viridis", showscale=True, colorbar=colorbar))
+
+    counts, x_edges, y_edges = np.histogram2d(volatility, returns, bins=bins)
+    sums, _, _ = np.histogram2d(volatility, returns, bins=[x_edges, y_edges], weights=sharpe)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_sharpe = np.where(counts > 0, sums / counts, np.nan)
+    utils.annotate_span(points=len(volatility), shipped_points=int((counts > 0).sum()))
+    return go.Heatmap(x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=mean_sharpe.T,
+                      customdata=counts.T, colorscale="Viridis", colorbar=colorbar, name="Simulated Portfolios",
+                      hovertemplate="Vol %{x:.2%}<br>Return %{y:.2%}<br>Mean Sharpe %{z:.2f}"
+                                    "<br>Portfolios %{customdata:.0f}<extra></extra>")
+
+def payload_kb(fig):
+    """
+    Size of the figure JSON sent to the browser, in KB.
+    """
+    kb = len(fig.to_json()) / 1024
+    utils.annotate_span(payload_kb=round(kb, 1))
+    return kb
+
+def fan_traces(fan, name, rgb=(122, 162, 247)):
+    """
+    Fan chart traces for one portfolio from simulation.fan_chart: the outer and inner percentile
+    bands as filled areas and the median as a line.
+    """
+    x = fan.index.to_numpy()
+    color = ",".join(str(c) for c in rgb)
+    columns = list(fan.columns)
+    traces = []
+    for (low, high), alpha in zip(zip(columns[:len(columns) // 2], columns[::-1]), (0.15, 0.3, 0.45)):
+        traces += [go.Scatter(x=x, y=fan[low], mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip",
+                              legendgroup=name),
+                   go.Scatter(x=x, y=fan[high], mode="lines", line=dict(width=0), fill="tonexty",
+                              fillcolor=f"rgba({color},{alpha})", name=f"{name} {low}-{high}", legendgroup=name)]
+    if len(columns) % 2:
+        median = columns[len(columns) // 2]
+        traces.append(go.Scatter(x=x, y=fan[median], mode="lines", line=dict(color=f"rgb({color})", width=2),
+                                 name=f"{name} median", legendgroup=name))
+    return traces
@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+import utils
+
+# Imported on first use, like utils.sco, so the pages importing this module stay quick to load
+sp = utils._LazyModule("scipy.sparse")
+
+OBJECTIVES = ("max_sharpe", "min_vol")
+
+def solve_qp(P, q, A, lower, upper, rho=0.1, sigma=1e-6, alpha=1.6, eps_abs=1e-7, eps_rel=1e-7,
+             eps_infeasible=1e-6, max_iter=20000, x0=None, y0=None):
+    """
+    ADMM solver (the OSQP iteration) for  min 1/2 x'Px + q'x  s.t.  lower <= Ax <= upper,
+    with A a sparse matrix and infinite bounds allowed. Equality rows (lower == upper) get a
+    larger step size. The linear system  P + sigma I + A' diag(rho) A  is inverted once and
+    again only when rho is rebalanced against the residuals, so each iteration costs two
+    sparse products and one dense one. x0/y0 warm-start the primal and dual iterates.
+    Stops early with message "infeasible" on a certificate of primal infeasibility.
+    Returns an OptimizeResult with x, y (constraint multipliers), nit, success and message.
+    """
+    import scipy.linalg as sla
+    P = np.asarray(P, dtype=float)
+    A = sp.csr_matrix(A)
+    AT = A.T.tocsr()
+    m, n = A.shape
+    q = np.asarray(q, dtype=float)
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    equality = np.isclose(lower, upper)
+
+    def factor(rho):
+        rho_vec = np.where(equality, 1e3 * rho, rho)
+        K = P + sigma * np.eye(n) + (AT @ sp.diags(rho_vec) @ A).toarray()
+        # An explicit inverse: one matrix-vector product per iteration beats two triangular solves
+        return rho_vec, sla.cho_solve(sla.cho_factor(K, check_finite=False), np.eye(n), check_finite=False)
+
+    x = np.zeros(n) if x0 is None else np.asarray(x0, dtype=float)
+    y = np.zeros(m) if y0 is None else np.asarray(y0, dtype=float)
+    z = np.clip(A @ x, lower, upper)
+    rho_vec, K_inv = factor(rho)
+    status = "maximum iterations reached"
+    for it in range(1, max_iter + 1):
+        y_previous = y
+        x_tilde = K_inv @ (sigma * x - q + AT @ (rho_vec * z - y))
+        z_tilde = A @ x_tilde
+        x = alpha * x_tilde + (1 - alpha) * x
+        z_relaxed = alpha * z_tilde + (1 - alpha) * z
+        z_next = np.clip(z_relaxed + y / rho_vec, lower, upper)
+        y = y + rho_vec * (z_relaxed - z_next)
+        z = z_next
+
+        if it % 10 == 0:
+            Ax, Px, ATy = A @ x, P @ x, AT @ y
+            primal = np.abs(Ax - z).max(initial=0.0)
+            dual = np.abs(Px + q + ATy).max(initial=0.0)
+            primal_scale = max(np.abs(Ax).max(initial=0.0), np.abs(z).max(initial=0.0))
+            dual_scale = max(np.abs(Px).max(initial=0.0), np.abs(ATy).max(initial=0.0), np.abs(q).max(initial=0.0))
+            if primal <= eps_abs + eps_rel * primal_scale and dual <= eps_abs + eps_rel * dual_scale:
+                status = "converged"
+                break
+            # Certificate of primal infeasibility: the dual iterates diverge along a direction dy
+            # with A'dy = 0 and u'max(dy, 0) + l'min(dy, 0) < 0
+            dy = y - y_previous
+            size = np.abs(dy).max(initial=0.0)
+            if size > 0 and np.abs(AT @ dy).max(initial=0.0) <= eps_infeasible * size:
+                with np.errstate(invalid="ignore"):
+                    support = np.where(dy > 0, upper * dy, 0.0).sum() + np.where(dy < 0, lower * dy, 0.0).sum()
+                if support < -eps_infeasible * size:
+                    status = "infeasible"
+                    break
+            if it % 50 == 0:
+                # Rebalance the step size when the residuals drift far apart (refactors K)
+                ratio = np.sqrt((primal / max(primal_scale, 1e-12)) / max(dual / max(dual_scale, 1e-12), 1e-12))
+                if ratio > 5 or ratio < 0.2:
+                    rho = float(np.clip(rho * ratio, 1e-6, 1e6))
+                    rho_vec, K_inv = factor(rho)
+    return utils.sco.OptimizeResult(x=x, y=y, nit=it, success=status == "converged", message=status,
+                                    fun=0.5 * x @ P @ x + q @ x)
+
+def sector_matrix(tickers, sectors=None):
+    """
+    Sparse (sectors x tickers) membership matrix. sectors maps sector -> tickers (default: the
+    security master's sectors); tickers in no sector are grouped under "Other".
+    Returns (sector names, matrix).
+    """
+    sectors = utils.get_stock_universe() if sectors is None else sectors
+    position = {t: i for i, t in enumerate(tickers)}
+    names, rows, cols = [], [], []
+    assigned = set()
+    for sector, members in sectors.items():
+        columns = [position[t] for t in dict.fromkeys(members) if t in position and t not in assigned]
+        if columns:
+            rows += [len(names)] * len(columns)
+            cols += columns
+            names.append(sector)
+            assigned.update(tickers[c] for c in columns)
+    others = [i for i, t in enumerate(tickers) if t not in assigned]
+    if others:
+        rows += [len(names)] * len(others)
+        cols += others
+        names.append("Other")
+    return names, sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(names), len(tickers)))
+
+def _asset_bounds(tickers, asset_bounds):
+    # (lo, hi) for every asset, or a dict of per-ticker (lo, hi) on top of long-only (0, 1)
+    if isinstance(asset_bounds, dict):
+        bounds = np.array([asset_bounds.get(t, (0.0, 1.0)) for t in tickers], dtype=float)
+    else:
+        bounds = np.tile(np.asarray(asset_bounds, dtype=float), (len(tickers), 1))
+    return bounds[:, 0], bounds[:, 1]
+
+def build_constraints(tickers, mean_returns, objective="max_sharpe", risk_free_rate=0.02, lower=None, upper=None,
+                      sector_names=None, sectors=None, sector_bounds=None, current_weights=None, max_turnover=None,
+                      target_return=None):
+    """
+    Assembles the constraints as one sparse system  lo <= A x <= hi  over x = [y, t, k]: scaled
+    weights y (w = y / k), turnover slacks t (only with max_turnover) and the scale k. Every
+    weight constraint is written homogeneously in (y, k), so the same rows serve min volatility
+    (k = 1) and the max Sharpe reformulation  min y'Sy  s.t.  (mu - rf)'y = 1.
+    lower/upper are the per-asset bounds, sectors the membership matrix of sector_names and
+    sector_bounds maps a sector to its (floor, cap).
+    """
+    n = len(tickers)
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    turnover = max_turnover is not None
+    n_t = n if turnover else 0
+    blocks, lo, hi = [], [], []
+
+    def add(y_part, k_part, row_lo, row_hi, t_part=None):
+        rows = y_part.shape[0]
+        t_part = sp.csr_matrix((rows, n_t)) if t_part is None else t_part
+        blocks.append(sp.hstack([y_part, t_part, sp.csr_matrix(np.reshape(k_part, (rows, 1)))]))
+        lo.append(np.broadcast_to(row_lo, rows))
+        hi.append(np.broadcast_to(row_hi, rows))
+
+    if objective == "max_sharpe":
+        add(sp.csr_matrix(mean_returns - risk_free_rate), 0.0, 1.0, 1.0)
+    else:
+        add(sp.csr_matrix((1, n)), 1.0, 1.0, 1.0)
+    add(sp.csr_matrix(np.ones((1, n))), -1.0, 0.0, 0.0)
+    add(sp.csr_matrix((1, n)), 1.0, 0.0, np.inf)
+    identity = sp.identity(n, format="csr")
+    add(identity, -lower, 0.0, np.inf)
+    capped = np.flatnonzero(upper < 1)
+    if len(capped):
+        add(identity[capped], -upper[capped], -np.inf, 0.0)
+    for sector, (floor, cap) in (sector_bounds or {}).items():
+        if sector not in sector_names:
+            continue
+        row = sectors[sector_names.index(sector)]
+        if floor is not None and floor > 0:
+            add(row, -floor, 0.0, np.inf)
+        if cap is not None and cap < 1:
+            add(row, -cap, -np.inf, 0.0)
+    if target_return is not None:
+        add(sp.csr_matrix(mean_returns), -target_return, 0.0, np.inf)
+    if turnover:
+        # t >= |y - k w0| and sum(t) <= k * max_turnover
+        w0 = np.asarray(current_weights, dtype=float)
+        add(identity, -w0, -np.inf, 0.0, t_part=-identity)
+        add(identity, -w0, 0.0, np.inf, t_part=identity)
+        add(sp.csr_matrix((1, n)), -max_turnover, -np.inf, 0.0, t_part=sp.csr_matrix(np.ones((1, n))))
+    return sp.vstack(blocks, format="csr"), np.concatenate(lo), np.concatenate(hi)
+
+def _feasible(A, lower, upper):
+    # A zero-objective LP (HiGHS) settles feasibility far sooner than ADMM's infeasibility certificate
+    finite_upper, finite_lower = np.isfinite(upper), np.isfinite(lower)
+    result = utils.sco.linprog(np.zeros(A.shape[1]), A_ub=sp.vstack([A[finite_upper], -A[finite_lower]]),
+                               b_ub=np.r_[upper[finite_upper], -lower[finite_lower]], bounds=(None, None),
+                               method="highs")
+    return result.status != 2
+
+@utils.instrumented("constrained optimize")
+def optimize_constrained(mean_returns, cov_matrix, objective="max_sharpe", risk_free_rate=0.02,
+                         asset_bounds=(0.0, 1.0), sector_bounds=None, sectors=None, current_weights=None,
+                         max_turnover=None, max_assets=None, target_return=None):
+    """
+    Max Sharpe or min volatility portfolio under linear constraints:
+    asset_bounds, as (lo, hi) for every asset or a dict of per-ticker bounds;
+    sector_bounds, a dict of sector -> (floor, cap), with the sectors of get_stock_universe
+    unless `sectors` (sector -> tickers) is given;
+    max_turnover, a limit on sum(|w - current_weights|);
+    target_return, a minimum annualized return;
+    max_assets, a cardinality limit.
+
+    The constraints form one sparse system (build_constraints) solved as a QP with solve_qp.
+    The cardinality limit is applied heuristically rather than as a mixed integer program: the
+    assets outside the largest max_assets weights are fixed at zero and the problem re-solved
+    until the limit holds. Returns an OptimizeResult like optimize_portfolio's (fun is the
+    negative Sharpe ratio or the volatility). Raises ValueError when the constraints are
+    infeasible or the solver does not converge.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective: {objective}")
+    tickers = list(mean_returns.index)
+    mean = mean_returns.to_numpy(dtype=float)
+    cov = utils._as_cov(cov_matrix)
+    cov = cov.to_dense() if isinstance(cov, utils.FactorCovariance) else cov
+    n = len(tickers)
+    lower, upper = _asset_bounds(tickers, asset_bounds)
+    sector_names, sector_rows = sector_matrix(tickers, sectors) if sector_bounds else (None, None)
+    if lower.sum() > 1 + 1e-9 or upper.sum() < 1 - 1e-9 or (lower > upper).any():
+        raise ValueError("Asset bounds admit no fully invested portfolio.")
+    if sum(floor or 0 for floor, _ in (sector_bounds or {}).values()) > 1 + 1e-9:
+        raise ValueError("Sector floors add up to more than 100%.")
+    if objective == "max_sharpe" and not np.any(mean > risk_free_rate):
+        raise ValueError("No asset has a return above the risk free rate.")
+    if current_weights is not None:
+        current_weights = pd.Series(current_weights).reindex(tickers).fillna(0.0).to_numpy(dtype=float) \
+            if isinstance(current_weights, (pd.Series, dict)) else np.asarray(current_weights, dtype=float)
+
+    n_x = 2 * n + 1 if max_turnover is not None else n + 1
+    P = np.zeros((n_x, n_x))
+    P[:n, :n] = cov
+    x0 = None
+    nit = 0
+    while True:
+        A, lo, hi = build_constraints(tickers, mean, objective, risk_free_rate, lower, upper, sector_names,
+                                      sector_rows, sector_bounds, current_weights, max_turnover, target_return)
+        if not _feasible(A, lo, hi):
+            raise ValueError("The constraints admit no portfolio." if x0 is None else
+                             f"No portfolio of at most {max_assets} assets satisfies the constraints.")
+        result = solve_qp(P, np.zeros(n_x), A, lo, hi, x0=x0)
+        nit += result.nit
+        if not result.success:
+            raise ValueError("Constrained optimization did not converge; the constraints may be infeasible.")
+        weights = np.clip(result.x[:n], 0, None)
+        weights /= weights.sum()
+        held = np.flatnonzero(weights > 1e-6)
+        if max_assets is None or len(held) <= max_assets:
+            break
+        # Keep the assets that must be held, then the largest weights; fix the rest at zero
+        keep = np.argsort(-(weights + (lower > 0)))[:max_assets]
+        dropped = np.setdiff1d(np.arange(n), keep)
+        upper = upper.copy()
+        upper[dropped] = 0.0
+        if upper.sum() < 1 - 1e-9:
+            raise ValueError(f"No portfolio of at most {max_assets} assets satisfies the asset bounds.")
+        x0 = result.x
+
+    ret, vol = utils.portfolio_performance(weights, mean, cov)
+    fun = -(ret - risk_free_rate) / vol if objective == "max_sharpe" else vol
+    utils.annotate_span(nit=nit, assets=n, constraints=A.shape[0])
+    return utils.sco.OptimizeResult(x=weights, success=True, status=0, nit=nit, nfev=0, njev=0, fun=fun,
+                                    message="Constrained QP converged")
+
+cached_optimize_constrained = utils.memoize(optimize_constrained)
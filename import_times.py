@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# What a cold page render pays for: the app modules, and the third party packages behind them
+TARGETS = ["utils", "charts", "risk", "constrained", "backtest", "batch", "streamlit", "plotly.graph_objects",
+           "plotly.express", "pandas", "numpy", "scipy.optimize", "yfinance"]
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def import_profile(module):
+    """
+    Imports `module` in a fresh interpreter with -X importtime and returns one row per module it
+    pulled in: self and cumulative time in ms, and nesting depth (0 = imported by the target itself).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise ImportError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000,
+                         "depth": (len(indent) - 1) // 2})
+    return rows
+
+def measure(targets, repeat=3, top=5):
+    """
+    Best-of-`repeat` cold import time of each target, with the heaviest modules it imports directly.
+    Modules already imported by the interpreter at startup are not counted.
+    """
+    report = []
+    for target in targets:
+        runs = [import_profile(target) for _ in range(repeat)]
+        best = min(runs, key=lambda rows: rows[-1]["cumulative_ms"])
+        # The target is reported last, after its own imports; anything before those was startup
+        start = max([i + 1 for i, r in enumerate(best[:-1]) if r["depth"] == 0], default=0)
+        loaded = best[start:]
+        direct = sorted((r for r in loaded if r["depth"] == 1), key=lambda r: -r["cumulative_ms"])
+        report.append({"module": target, "ms": loaded[-1]["cumulative_ms"], "modules_loaded": len(loaded),
+                       "heaviest": [{"module": r["module"], "ms": r["cumulative_ms"]} for r in direct[:top]]})
+        print(f"{target:<22} {loaded[-1]['cumulative_ms']:8.1f} ms  {len(loaded):4d} modules  "
+              + ", ".join(f"{r['module']} {r['cumulative_ms']:.0f}" for r in direct[:top]))
+    return report
+
+def compare(report, baseline, tolerance=1.25, floor_ms=20.0):
+    """
+    Targets whose import time exceeds the baseline by more than `tolerance`x (ignoring imports under floor_ms).
+    """
+    base = {b["module"]: b["ms"] for b in baseline}
+    return [{**r, "baseline": base[r["module"]]} for r in report
+            if r["module"] in base and r["ms"] > tolerance * max(base[r["module"]], floor_ms)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold import time of the app modules and their dependencies.")
+    parser.add_argument("--modules", nargs="*", default=TARGETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Heaviest direct imports to show per module")
+    parser.add_argument("--output", default="import_times.json")
+    parser.add_argument("--baseline", help="Previous output to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    report = measure(args.modules, args.repeat, args.top)
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version.split()[0], "results": report}, f, indent=2)
+    print(f"Wrote {len(report)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f)["results"], args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['module']}: {r['baseline']:.1f} ms -> {r['ms']:.1f} ms")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,6 @@
 import streamlit as st
 import utils
-import plotly.express as px
+import charts
 import pandas as pd
 
 st.set_page_config(page_title="Market Explorer", page_icon="🔍", layout="wide")
@@ -19,15 +19,12 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 st.title("🔍 Market Explorer")
+utils.start_perf_run()
 
 # --- Sidebar Controls ---
 st.sidebar.header("Data Selection")
-universe = utils.get_stock_universe()
-
-# Flatten the universe for easy searching
-all_tickers = []
-for sector, tickers in universe.items():
-    all_tickers.extend(tickers)
+master = utils.get_security_master()
+universe = master.sectors
 
 # Category selection helper
 selected_sector = st.sidebar.selectbox("Select Sector (Quick Add)", ["None"] + list(universe.keys()))
@@ -35,10 +32,17 @@ default_tickers = universe[selected_sector] if selected_sector != "None" else ["
 
 selected_tickers = st.sidebar.multiselect(
     "Select Tickers",
-    options=sorted(list(set(all_tickers))), # Unique and sorted
-    default=default_tickers
+    options=master.tickers, # Unique and sorted once, when the security master loads
+    default=[t for t in default_tickers if t in master],
+    format_func=master.label
 )
 
+search = st.sidebar.text_input("Search by ticker or company name")
+if search:
+    matches = master.search(search, limit=10)
+    found = st.sidebar.multiselect("Matches", [r["ticker"] for r in matches], format_func=master.label)
+    selected_tickers += [t for t in found if t not in selected_tickers]
+
 input_tickers = st.sidebar.text_input("Add Custom Tickers (comma separated, e.g. NVDA, TSLA)")
 
 if input_tickers:
@@ -49,6 +53,7 @@ if input_tickers:
             selected_tickers.append(t)
 
 period = st.sidebar.selectbox("Time Period", ["1y", "2y", "5y", "10y", "max"], index=1)
+show_perf = st.sidebar.checkbox("Show performance panel", value=False)
 
 if not selected_tickers:
     st.warning("Please select at least one ticker to view data.")
@@ -56,20 +61,32 @@ if not selected_tickers:
 
 # --- Data Fetching ---
 with st.spinner("Fetching Market Data..."):
-    df = utils.fetch_stock_data(selected_tickers, period=period)
+    # Statistics persist across reruns (one object per period), so editing the selection only
+    # fetches and estimates the added tickers. Each ticker keeps its full history.
+    stats = st.session_state.setdefault(f"explorer_statistics_{period}", utils.PortfolioStatistics(period))
+    stats.select(selected_tickers)
+    # Everything below reads from one analytics context, so nothing is computed twice
+    analytics = stats.context()
+    df = analytics.prices
 
 if df.empty:
     st.error("No data found for the selected tickers.")
     st.stop()
 
+missing_tickers = [t for t in selected_tickers if t in stats.missing]
+if missing_tickers:
+    st.warning(f"No price data returned for: {', '.join(missing_tickers)}")
+
 # --- Company Reference Table ---
 with st.expander("Show Selected Company Names", expanded=False):
-    ticker_map = utils.get_ticker_name_mapping()
     company_data = []
     for t in selected_tickers:
+        record = master.records.get(t, {})
         company_data.append({
             "Ticker": t,
-            "Company Name": ticker_map.get(t, "Unknown / Custom")
+            "Company Name": master.name(t),
+            "Sector": record.get("sector", ""),
+            "Exchange": record.get("exchange", "")
         })
     company_df = pd.DataFrame(company_data)
     st.dataframe(company_df, use_container_width=True, hide_index=True)
@@ -78,29 +95,35 @@ with st.expander("Show Selected Company Names", expanded=False):
 
 # Normalized Price Chart (Rebased to 100)
 st.subheader("📈 Normalized Price History (Base = 100)")
-normalized_df = df / df.iloc[0] * 100
-fig_price = px.line(normalized_df, x=normalized_df.index, y=normalized_df.columns, template="plotly_dark")
-fig_price.update_layout(height=500, xaxis_title="Date", yaxis_title="Normalized Price")
-st.plotly_chart(fig_price, use_container_width=True)
+with utils.perf_span("render price chart"):
+    normalized_df = analytics.normalized_prices
+    # WebGL traces, downsampled to what the chart can actually show
+    fig_price = charts.line_figure(normalized_df, template="plotly_dark", height=500, xaxis_title="Date",
+                                   yaxis_title="Normalized Price", legend_title_text="Ticker")
+    st.plotly_chart(fig_price, use_container_width=True)
+    st.caption(f"{len(normalized_df):,} trading days per ticker, chart payload {charts.payload_kb(fig_price):,.0f} KB")
 
 col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("📊 Statistics")
-    daily_returns = utils.calculate_daily_returns(df)
-    mean_ret, cov = utils.calculate_annualized_metrics(daily_returns)
-    volatility = daily_returns.std() * (252**0.5)
-    
     stats_df = pd.DataFrame({
-        "Annualized Return": mean_ret,
-        "Annualized Volatility": volatility
+        "Annualized Return": analytics.mean_returns,
+        "Annualized Volatility": analytics.volatility
     })
     st.dataframe(stats_df.style.format("{:.2%}"), use_container_width=True)
 
 with col2:
     st.subheader("📉 Correlation Matrix")
-    corr_matrix = df.pct_change().corr()
-    st.dataframe(corr_matrix.style.format("{:.2f}"), use_container_width=True)
+    with utils.perf_span("correlation matrix"):
+        corr_matrix = analytics.correlation
+        st.dataframe(corr_matrix.style.format("{:.2f}"), use_container_width=True)
 
 with st.expander("View Raw Data"):
     st.dataframe(df)
+
+if show_perf:
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        st.dataframe(utils.perf_summary(), use_container_width=True, hide_index=True)
+        st.caption(f"Result cache: {utils.get_result_cache().stats}")
+        st.caption(f"Price cache: {utils.get_price_cache().stats}")
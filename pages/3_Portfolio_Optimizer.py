@@ -1,5 +1,9 @@
 import streamlit as st
 import utils
+import charts
+import simulation
+import risk
+import constrained
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
@@ -20,16 +24,17 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 st.title("🚀 Portfolio Optimization Engine")
+utils.start_perf_run()
 
 # --- Sidebar Inputs ---
 st.sidebar.header("Configuration")
-universe = utils.get_stock_universe()
-all_tickers = [t for list_t in universe.values() for t in list_t]
+master = utils.get_security_master()
 
 selected_tickers = st.sidebar.multiselect(
     "Select Assets for Portfolio",
-    options=sorted(list(set(all_tickers))),
-    default=["AAPL", "MSFT", "GOOGL", "AMZN", "NVDA"]
+    options=master.tickers,
+    default=[t for t in ["AAPL", "MSFT", "GOOGL", "AMZN", "NVDA"] if t in master],
+    format_func=master.label
 )
 
 input_tickers = st.sidebar.text_input("Add Custom Tickers (e.g. SPY, GLD)")
@@ -40,136 +45,278 @@ if input_tickers:
             selected_tickers.append(t)
 
 risk_free_rate = st.sidebar.slider("Risk Free Rate (%)", 0.0, 10.0, 2.0, step=0.1) / 100.0
+RISK_FREE_GRID = np.round(np.arange(0.0, 10.05, 0.1), 1) / 100.0
+num_portfolios = st.sidebar.select_slider("Simulated Portfolios", options=[2000, 5000, 20000, 50000, 100000], value=2000)
+with st.sidebar.expander("Constraints"):
+    max_asset_weight = st.slider("Max Weight per Asset (%)", 5, 100, 100, step=5) / 100.0
+    max_sector_weight = st.slider("Max Weight per Sector (%)", 5, 100, 100, step=5) / 100.0
+    max_holdings = st.number_input("Max Holdings (0 = no limit)", min_value=0, max_value=500, value=0)
+use_constraints = max_asset_weight < 1 or max_sector_weight < 1 or max_holdings > 0
+show_perf = st.sidebar.checkbox("Show performance panel", value=False)
 
 if len(selected_tickers) < 2:
     st.warning("Please select at least 2 assets to optimize a portfolio.")
     st.stop()
 
 # --- Analysis Trigger ---
+# Remember that the user ran the optimization, so later widget changes (e.g. the risk free
+# slider) re-render the results instead of resetting the page. Results come from the shared
+# result cache, so those reruns only recompute what actually changed.
 if st.button("Run Optimization"):
+    st.session_state["optimization_requested"] = True
+
+if st.session_state.get("optimization_requested"):
     with st.spinner("Downloading Data & Simulating..."):
         # Fetch Data
-        df = utils.fetch_stock_data(selected_tickers)
-        if df.empty:
+        # Statistics persist across reruns: editing the selection only fetches and estimates the
+        # added tickers. Each ticker keeps its full history; the covariance uses pairwise overlaps.
+        stats = st.session_state.setdefault("portfolio_statistics", utils.PortfolioStatistics())
+        stats.select(selected_tickers)
+        if len(stats.tickers) < 2:
             st.error("No data found.")
             st.stop()
             
-        daily_returns = utils.calculate_daily_returns(df)
-        mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns)
+        analytics = stats.context()
+        daily_returns = analytics.returns
+        mean_ret, cov_matrix = analytics.mean_returns, analytics.cov_matrix
         
-        # Optimize
-        max_sharpe, min_vol = utils.optimize_portfolio(mean_ret, cov_matrix, risk_free_rate)
+        # Optimize for every rate on the risk free slider at once, so moving the slider is a lookup
+        rf_sweep = utils.cached_batch_optimize(mean_ret, cov_matrix, risk_free_rates=RISK_FREE_GRID)
+        at_rate = rf_sweep[np.isclose(rf_sweep["risk_free_rate"], risk_free_rate)].set_index("portfolio")
+        max_sharpe, min_vol = at_rate.loc["max_sharpe"], at_rate.loc["min_vol"]
         
-        # Efficient Frontier Simulation
-        results, weights_record = utils.generate_efficient_frontier(mean_ret, cov_matrix, num_portfolios=2000, risk_free_rate=risk_free_rate)
+        # Efficient Frontier Simulation (rate independent; Sharpe is rescored for the slider below)
+        results, weights_record = utils.cached_generate_efficient_frontier(mean_ret, cov_matrix, num_portfolios=num_portfolios, risk_free_rate=0.0, return_weights=False)
+        sim_sharpe = (results[1,:] - risk_free_rate) / results[0,:]
         
         # Calculate Efficient Frontier Line (Envelope)
-        ef_returns, ef_volatilities = utils.calculate_efficient_frontier_line(mean_ret, cov_matrix)
+        ef_returns, ef_volatilities = utils.cached_calculate_efficient_frontier_line(mean_ret, cov_matrix)
         
         # Max Sharpe Results
-        max_sharpe_ret, max_sharpe_vol = utils.portfolio_performance(max_sharpe.x, mean_ret, cov_matrix)
+        max_sharpe_ret, max_sharpe_vol = max_sharpe["return"], max_sharpe["volatility"]
         
         # Min Vol Results
-        min_vol_ret, min_vol_vol = utils.portfolio_performance(min_vol.x, mean_ret, cov_matrix)
+        min_vol_ret, min_vol_vol = min_vol["return"], min_vol["volatility"]
+        
+        # Min CVaR Results (linear program over the historical daily scenarios)
+        min_cvar_weights = None
+        try:
+            min_cvar = risk.cached_minimize_cvar(daily_returns)
+            min_cvar_weights = pd.Series(min_cvar.x, index=mean_ret.index)
+            min_cvar_ret, min_cvar_vol = analytics.performance(min_cvar.x)
+        except ValueError as e:
+            st.warning(f"Min CVaR optimization: {e}")
+        
+        # Constrained Results (sector caps use the security master's sectors)
+        constrained_results = {}
+        if use_constraints:
+            sector_names, sector_rows = constrained.sector_matrix(list(mean_ret.index))
+            sector_bounds = {s: (None, max_sector_weight) for s in sector_names} if max_sector_weight < 1 else None
+            try:
+                for name, objective in (("Max Sharpe", "max_sharpe"), ("Min Volatility", "min_vol")):
+                    constrained_results[name] = constrained.cached_optimize_constrained(
+                        mean_ret, cov_matrix, objective, risk_free_rate, asset_bounds=(0.0, max_asset_weight),
+                        sector_bounds=sector_bounds, max_assets=max_holdings or None)
+            except ValueError as e:
+                st.warning(f"Constrained optimization: {e}")
+                constrained_results = {}
 
     # --- Display Results ---
     
     # 1. Efficient Frontier & CAL Plot
     st.subheader("Efficient Frontier & Capital Allocation Line")
     
-    # Scatter of simulated portfolios
-    fig = go.Figure()
-    
-    fig.add_trace(go.Scatter(
-        x=results[0,:], 
-        y=results[1,:],
-        mode='markers',
-        marker=dict(
-            color=results[2,:], 
-            colorscale='Viridis', 
-            showscale=True,
-            colorbar=dict(title="Sharpe Ratio")
-        ),
-        name='Simulated Portfolios'
-    ))
-
-    # Efficient Frontier Line
-    fig.add_trace(go.Scatter(
-        x=ef_volatilities, y=ef_returns,
-        mode='lines', line=dict(color='#6BFFB8', width=2), # Specific green distinct from others
-        name='Efficient Frontier'
-    ))
-    
-    # Max Sharpe Point
-    fig.add_trace(go.Scatter(
-        x=[max_sharpe_vol], y=[max_sharpe_ret],
-        mode='markers', marker=dict(color='red', size=14, symbol='star'),
-        name='Max Sharpe Ratio'
-    ))
-    
-    # Min Vol Point
-    fig.add_trace(go.Scatter(
-        x=[min_vol_vol], y=[min_vol_ret],
-        mode='markers', marker=dict(color='blue', size=14, symbol='circle'),
-        name='Min Volatility'
-    ))
-    
-    # CAL Line
-    # Point 1: Risk Free Rate (Vol=0, Ret=Rf)
-    # Point 2: Max Sharpe Portfolio (Vol=max_sharpe_vol, Ret=max_sharpe_ret)
-    # Extend line a bit
-    cal_x = [0, max_sharpe_vol * 1.5]
-    slope = (max_sharpe_ret - risk_free_rate) / max_sharpe_vol
-    cal_y = [risk_free_rate, risk_free_rate + slope * (max_sharpe_vol * 1.5)]
-    
-    fig.add_trace(go.Scatter(
-        x=cal_x, y=cal_y, mode='lines', line=dict(color='#99c0d9', dash='dash', width=2),
-        name='Capital Allocation Line (CAL)'
-    ))
-
-    # Add Risk Free Asset Marker
-    fig.add_trace(go.Scatter(
-        x=[0], y=[risk_free_rate],
-        mode='markers+text', 
-        marker=dict(color='#99c0d9', size=10, symbol='diamond'),
-        text=['Rf'], textposition="top right",
-        name='Risk Free Rate'
-    ))
-    
-    fig.update_layout(
-        template="plotly_dark",
-        xaxis=dict(title="Annualized Volatility (Risk)", rangemode="tozero"),
-        yaxis=dict(title="Annualized Return"),
-        height=600,
-        legend=dict(x=0.02, y=0.98)
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    with utils.perf_span("render frontier chart"):
+        # Simulated portfolios: WebGL markers, or a Sharpe-colored density for large clouds
+        fig = go.Figure()
+        fig.add_trace(charts.frontier_cloud_trace(results[0,:], results[1,:], sim_sharpe))
+
+        # Efficient Frontier Line
+        fig.add_trace(go.Scatter(
+            x=ef_volatilities, y=ef_returns,
+            mode='lines', line=dict(color='#6BFFB8', width=2), # Specific green distinct from others
+            name='Efficient Frontier'
+        ))
+    
+        # Max Sharpe Point
+        fig.add_trace(go.Scatter(
+            x=[max_sharpe_vol], y=[max_sharpe_ret],
+            mode='markers', marker=dict(color='red', size=14, symbol='star'),
+            name='Max Sharpe Ratio'
+        ))
+    
+        # Min Vol Point
+        fig.add_trace(go.Scatter(
+            x=[min_vol_vol], y=[min_vol_ret],
+            mode='markers', marker=dict(color='blue', size=14, symbol='circle'),
+            name='Min Volatility'
+        ))
+    
+        # Min CVaR Point
+        if min_cvar_weights is not None:
+            fig.add_trace(go.Scatter(
+                x=[min_cvar_vol], y=[min_cvar_ret],
+                mode='markers', marker=dict(color='orange', size=12, symbol='square'),
+                name='Min CVaR (95%)'
+            ))
+    
+        # Constrained Points
+        for (name, result), symbol in zip(constrained_results.items(), ('star-open', 'circle-open')):
+            c_ret, c_vol = analytics.performance(result.x)
+            fig.add_trace(go.Scatter(
+                x=[c_vol], y=[c_ret],
+                mode='markers', marker=dict(color='#FFD166', size=14, symbol=symbol, line=dict(width=2)),
+                name=f'Constrained {name}'
+            ))
+    
+        # CAL Line
+        # Point 1: Risk Free Rate (Vol=0, Ret=Rf)
+        # Point 2: Max Sharpe Portfolio (Vol=max_sharpe_vol, Ret=max_sharpe_ret)
+        # Extend line a bit
+        cal_x = [0, max_sharpe_vol * 1.5]
+        slope = (max_sharpe_ret - risk_free_rate) / max_sharpe_vol
+        cal_y = [risk_free_rate, risk_free_rate + slope * (max_sharpe_vol * 1.5)]
+    
+        fig.add_trace(go.Scatter(
+            x=cal_x, y=cal_y, mode='lines', line=dict(color='#99c0d9', dash='dash', width=2),
+            name='Capital Allocation Line (CAL)'
+        ))
+
+        # Add Risk Free Asset Marker
+        fig.add_trace(go.Scatter(
+            x=[0], y=[risk_free_rate],
+            mode='markers+text', 
+            marker=dict(color='#99c0d9', size=10, symbol='diamond'),
+            text=['Rf'], textposition="top right",
+            name='Risk Free Rate'
+        ))
+    
+        fig.update_layout(
+            template="plotly_dark",
+            xaxis=dict(title="Annualized Volatility (Risk)", rangemode="tozero"),
+            yaxis=dict(title="Annualized Return"),
+            height=600,
+            legend=dict(x=0.02, y=0.98)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"{num_portfolios:,} simulated portfolios, chart payload {charts.payload_kb(fig):,.0f} KB")
     
     # 2. Portfolio Weights
     st.subheader("Optimal Portfolio Composition")
     
-    col1, col2 = st.columns(2)
+    with utils.perf_span("render weight charts"):
+        col1, col2 = st.columns(2)
     
-    with col1:
-        st.markdown("**Max Sharpe Portfolio**")
-        st.write(f"Return: `{max_sharpe_ret:.2%}` | Volatility: `{max_sharpe_vol:.2%}` | Sharpe: `{results[2,:].max():.2f}`")
+        with col1:
+            st.markdown("**Max Sharpe Portfolio**")
+            st.write(f"Return: `{max_sharpe_ret:.2%}` | Volatility: `{max_sharpe_vol:.2%}` | Sharpe: `{max_sharpe['sharpe']:.2f}`")
+        
+            # Clean weights < 1%
+            ms_weights = max_sharpe[mean_ret.index].astype(float)
+            ms_weights = ms_weights[ms_weights > 0.01]
         
-        # Clean weights < 1%
-        ms_weights = pd.Series(max_sharpe.x, index=selected_tickers)
-        ms_weights = ms_weights[ms_weights > 0.01]
+            fig_pie1 = px.pie(values=ms_weights.values, names=ms_weights.index, title="Max Sharpe Weights", template="plotly_dark")
+            st.plotly_chart(fig_pie1, use_container_width=True)
         
-        fig_pie1 = px.pie(values=ms_weights.values, names=ms_weights.index, title="Max Sharpe Weights", template="plotly_dark")
-        st.plotly_chart(fig_pie1, use_container_width=True)
+        with col2:
+            st.markdown("**Min Volatility Portfolio**")
+            st.write(f"Return: `{min_vol_ret:.2%}` | Volatility: `{min_vol_vol:.2%}`")
         
-    with col2:
-        st.markdown("**Min Volatility Portfolio**")
-        st.write(f"Return: `{min_vol_ret:.2%}` | Volatility: `{min_vol_vol:.2%}`")
+            mv_weights = min_vol[mean_ret.index].astype(float)
+            mv_weights = mv_weights[mv_weights > 0.01]
         
-        mv_weights = pd.Series(min_vol.x, index=selected_tickers)
-        mv_weights = mv_weights[mv_weights > 0.01]
+            fig_pie2 = px.pie(values=mv_weights.values, names=mv_weights.index, title="Min Volatility Weights", template="plotly_dark")
+            st.plotly_chart(fig_pie2, use_container_width=True)
+
+    if constrained_results:
+        st.markdown("**Constrained Portfolios**")
+        c_weights = pd.DataFrame({name: result.x for name, result in constrained_results.items()},
+                                 index=mean_ret.index)
+        c_ret, c_vol = analytics.performance(c_weights.T.values)
+        st.dataframe(pd.DataFrame({
+            "Return": c_ret, "Volatility": c_vol, "Sharpe": (c_ret - risk_free_rate) / c_vol,
+            "Holdings": (c_weights > 1e-4).sum().values,
+        }, index=c_weights.columns).style.format({"Return": "{:.2%}", "Volatility": "{:.2%}", "Sharpe": "{:.2f}"}),
+            use_container_width=True)
+        sector_weights = pd.DataFrame(sector_rows @ c_weights.values, index=sector_names, columns=c_weights.columns)
+        st.dataframe(sector_weights.style.format("{:.1%}"), use_container_width=True)
+
+    # 3. Downside Risk
+    st.subheader("Downside Risk (95%, 1 Day)")
+    
+    with utils.perf_span("downside risk"):
+        portfolios = {
+            "Max Sharpe": max_sharpe[mean_ret.index].astype(float),
+            "Min Volatility": min_vol[mean_ret.index].astype(float),
+        }
+        performance = [(max_sharpe_ret, max_sharpe_vol), (min_vol_ret, min_vol_vol)]
+        if min_cvar_weights is not None:
+            portfolios["Min CVaR"] = min_cvar_weights
+            performance.append((min_cvar_ret, min_cvar_vol))
+        portfolios = pd.DataFrame(portfolios).T
+        try:
+            hist_var, hist_cvar = risk.historical_var_cvar(portfolios.values, daily_returns)
+        except ValueError as e:
+            st.warning(f"Historical VaR/CVaR: {e}")
+            hist_var = hist_cvar = np.full(len(portfolios), np.nan)
+        norm_var, norm_cvar = risk.parametric_var_cvar(portfolios.values, mean_ret, cov_matrix)
+        downside = pd.DataFrame({
+            "Return": [ret for ret, _ in performance],
+            "Volatility": [vol for _, vol in performance],
+            "Historical VaR": hist_var, "Historical CVaR": hist_cvar,
+            "Normal VaR": norm_var, "Normal CVaR": norm_cvar,
+        }, index=portfolios.index)
+        st.dataframe(downside.style.format("{:.2%}", na_rep="n/a"), use_container_width=True)
+        st.caption("VaR is the daily loss exceeded on 5% of days, CVaR the average loss on those days. "
+                   "Historical figures use the days on which every asset traded; normal figures assume "
+                   "normally distributed returns with the annualized mean and covariance.")
         
-        fig_pie2 = px.pie(values=mv_weights.values, names=mv_weights.index, title="Min Volatility Weights", template="plotly_dark")
-        st.plotly_chart(fig_pie2, use_container_width=True)
+        if min_cvar_weights is not None:
+            mc_weights = min_cvar_weights[min_cvar_weights > 0.01]
+            fig_pie3 = px.pie(values=mc_weights.values, names=mc_weights.index, title="Min CVaR Weights", template="plotly_dark")
+            st.plotly_chart(fig_pie3, use_container_width=True)
+
+    # 4. Forward Simulation
+    st.subheader("Simulated Future Portfolio Value")
+    
+    sim_col1, sim_col2, sim_col3 = st.columns(3)
+    horizon_years = sim_col1.selectbox("Horizon (years)", [1, 2, 3, 5], index=0)
+    sim_method = sim_col2.selectbox("Simulation Method", simulation.METHODS,
+                                    format_func={"normal": "Multivariate normal", "bootstrap": "Block bootstrap"}.get)
+    num_paths = sim_col3.select_slider("Paths", options=[1000, 5000, 10000, 20000, 50000], value=10000)
+    
+    with st.spinner("Simulating future paths..."):
+        # Values are recorded weekly, which is plenty for the chart and keeps long horizons light
+        simulations = {
+            name: simulation.cached_simulate(portfolio[mean_ret.index].to_numpy(dtype=float), daily_returns,
+                                             horizon=252 * horizon_years, num_paths=num_paths, method=sim_method,
+                                             record_every=5, seed=0)
+            for name, portfolio in (("Max Sharpe", max_sharpe), ("Min Volatility", min_vol))
+        }
+    
+    with utils.perf_span("render simulation chart"):
+        fig_sim = go.Figure()
+        for (name, result), rgb in zip(simulations.items(), ((255, 99, 99), (122, 162, 247))):
+            fig_sim.add_traces(charts.fan_traces(result["fan"], name, rgb))
+        fig_sim.update_layout(
+            template="plotly_dark",
+            xaxis=dict(title="Trading Days Ahead"),
+            yaxis=dict(title="Value of $1 Invested"),
+            height=500
+        )
+        st.plotly_chart(fig_sim, use_container_width=True)
+    
+        terminal = pd.DataFrame({name: result["terminal"] for name, result in simulations.items()}).T
+        terminal.columns = ["1%", "5%", "25%", "Median", "75%", "95%", "99%", "Mean", "P(Loss)"]
+        st.markdown(f"**Value of $1 after {horizon_years} year{'s' if horizon_years > 1 else ''}** "
+                    f"({num_paths:,} buy-and-hold paths)")
+        st.dataframe(terminal.style.format("{:.2f}").format("{:.1%}", subset=["P(Loss)"]), use_container_width=True)
 
 else:
     st.info("Select tickers from the sidebar and click **Run Optimization** to begin.")
+
+if show_perf:
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        st.dataframe(utils.perf_summary(), use_container_width=True, hide_index=True)
+        st.caption(f"Result cache: {utils.get_result_cache().stats}")
+        st.caption(f"Price cache: {utils.get_price_cache().stats}")
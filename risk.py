@@ -0,0 +1,97 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import utils
+
+def _weight_matrix(weights):
+    W = np.asarray(weights, dtype=float)
+    return W[None, :] if W.ndim == 1 else W
+
+def _scenarios(daily_returns, min_scenarios=20):
+    # Historical scenarios are the dates on which every asset has a return
+    if isinstance(daily_returns, pd.DataFrame):
+        daily_returns = daily_returns.dropna()
+    scenarios = np.asarray(daily_returns, dtype=float)
+    scenarios = scenarios[~np.isnan(scenarios).any(axis=1)]
+    if len(scenarios) < min_scenarios:
+        raise ValueError(f"Only {len(scenarios)} dates on which every asset has a return; "
+                         f"historical risk needs at least {min_scenarios}.")
+    return scenarios
+
+def historical_var_cvar(weights, daily_returns, alpha=0.95, horizon=1, chunk_size=2000):
+    """
+    Historical Value at Risk and Conditional VaR (expected shortfall) at confidence alpha, as
+    positive fractions of portfolio value, for one weight vector or many (rows of a 2-D array,
+    e.g. the weights from generate_efficient_frontier).
+
+    The P&L of every portfolio in every historical scenario comes from one scenario-matrix
+    product per chunk of portfolios; the worst (1 - alpha) tail is then found with a partial sort
+    (np.partition) instead of sorting every column. horizon > 1 scales by sqrt(horizon).
+    Returns (var, cvar) arrays with one entry per portfolio. Raises ValueError when fewer than
+    20 dates have a return for every asset.
+    """
+    W = _weight_matrix(weights)
+    scenarios = _scenarios(daily_returns)
+    T = len(scenarios)
+    tail = max(1, int(np.ceil(round((1 - alpha) * T, 9))))
+    var, cvar = np.empty(len(W)), np.empty(len(W))
+    for lo in range(0, len(W), chunk_size):
+        losses = -(scenarios @ W[lo:lo + chunk_size].T)
+        # After partitioning, the last `tail` rows of each column are its largest losses
+        worst = np.partition(losses, T - tail, axis=0)[T - tail:]
+        var[lo:lo + chunk_size] = worst.min(axis=0)
+        cvar[lo:lo + chunk_size] = worst.mean(axis=0)
+    return var * np.sqrt(horizon), cvar * np.sqrt(horizon)
+
+def parametric_var_cvar(weights, mean_returns, cov_matrix, alpha=0.95, horizon=1):
+    """
+    Normal (variance-covariance) VaR and CVaR over `horizon` trading days from annualized mean
+    returns and covariance, for one weight vector or many. Returns (var, cvar) arrays.
+    """
+    W = _weight_matrix(weights)
+    mean = W @ np.asarray(mean_returns, dtype=float) * horizon / 252
+    sigma = np.sqrt(utils._portfolio_variances(W, utils._as_cov(cov_matrix)) * horizon / 252)
+    z = NormalDist().inv_cdf(alpha)
+    return z * sigma - mean, sigma * NormalDist().pdf(z) / (1 - alpha) - mean
+
+def minimize_cvar(daily_returns, alpha=0.95, target_return=None):
+    """
+    Long-only portfolio with the lowest historical CVaR: the Rockafellar-Uryasev linear program
+
+        min  zeta + sum(u) / ((1 - alpha) T)
+        s.t. u_t >= -r_t.w - zeta,  u >= 0,  sum(w) = 1,  w >= 0
+             (and annualized mean return >= target_return, if given)
+
+    solved through its dual, which has one constraint per asset instead of one per scenario:
+
+        max  lambda + tau * target
+        s.t. lambda + (R'q)_i + tau * mean_i <= 0  for each asset i,
+             sum(q) = 1,  0 <= q_t <= 1 / ((1 - alpha) T),  tau >= 0
+
+    The optimal weights are the multipliers of the asset constraints and the VaR that of the
+    budget constraint. With HiGHS' interior point method this handles thousands of scenarios by
+    hundreds of assets in seconds. Returns an OptimizeResult with x (weights), fun (CVaR) and
+    var (VaR at the optimum). Raises ValueError when there are too few complete scenarios.
+    """
+    import scipy.sparse as sp
+    scenarios = _scenarios(daily_returns)
+    T, n = scenarios.shape
+    target = 0.0 if target_return is None else target_return
+    mean = scenarios.mean(axis=0) * 252
+
+    # Variables: [q (T), lambda (1), tau (1)]
+    c = np.r_[np.zeros(T), -1.0, -target]
+    A_ub = sp.hstack([sp.csr_matrix(scenarios.T), np.ones((n, 1)), mean[:, None]], format="csr")
+    A_eq = sp.csr_matrix(np.r_[np.ones(T), 0.0, 0.0])
+    bounds = [(0, 1 / ((1 - alpha) * T))] * T + [(None, None), (0, 0 if target_return is None else None)]
+
+    result = utils.sco.linprog(c, A_ub=A_ub, b_ub=np.zeros(n), A_eq=A_eq, b_eq=[1.0], bounds=bounds,
+                               method="highs-ipm")
+    if not result.success:
+        raise ValueError(f"CVaR optimization failed: {result.message}")
+    weights = np.clip(-result.ineqlin.marginals, 0, None)
+    return utils.sco.OptimizeResult(x=weights / weights.sum(), success=True, status=0, fun=-result.fun,
+                                    var=-result.eqlin.marginals[0], nit=result.nit, message=result.message)
+
+cached_minimize_cvar = utils.memoize(minimize_cvar)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import utils
+
+METHODS = ("normal", "bootstrap")
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def _cholesky(cov):
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        # Singular (e.g. duplicated assets): factor through the clipped eigen decomposition
+        eigenvalues, eigenvectors = np.linalg.eigh(cov)
+        return eigenvectors * np.sqrt(np.maximum(eigenvalues, 0))
+
+def _block_rows(rng, num_paths, horizon, num_rows, block_size):
+    # Moving block bootstrap: each path strings together random blocks of consecutive historical days
+    block_size = min(block_size, num_rows)
+    num_blocks = -(-horizon // block_size)
+    starts = rng.integers(0, num_rows - block_size + 1, size=(num_paths, num_blocks))
+    return (starts[:, :, None] + np.arange(block_size)).reshape(num_paths, -1)[:, :horizon]
+
+def simulate_paths(weights, daily_returns, horizon=252, num_paths=10000, method="normal", block_size=21,
+                   rebalance=False, initial_value=1.0, record_every=1, seed=None, max_chunk_elements=5_000_000):
+    """
+    Simulates forward portfolio value paths for `weights` (aligned with the daily_returns columns).
+
+    method="normal" draws daily asset returns from a multivariate normal with the historical mean
+    and covariance (correlated through the Cholesky factor); "bootstrap" resamples blocks of
+    block_size consecutive historical days (complete rows only), keeping fat tails and volatility
+    clustering. Holdings are bought and held, or with rebalance=True reset to the weights daily.
+
+    Asset-level draws are generated in chunks of at most max_chunk_elements numbers, so memory is
+    bounded whatever the number of paths; only the portfolio values (float32, starting at
+    initial_value) every record_every days and at the horizon are kept. Returns them as a
+    DataFrame with one row per path and the day numbers as columns.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown simulation method: {method}")
+    weights = np.asarray(weights, dtype=float)
+    held = np.flatnonzero(np.abs(weights) > 1e-12)
+    weights = weights[held]
+    returns = daily_returns.iloc[:, held]
+
+    if method == "normal":
+        mean_returns, cov_matrix = utils.calculate_annualized_metrics(returns)
+        mean, cov = mean_returns.to_numpy() / 252, np.asarray(cov_matrix) / 252
+        if rebalance:
+            # A constant-mix portfolio's daily return is itself normal: simulate it directly
+            mean, cov, weights = np.array([weights @ mean]), np.array([[weights @ cov @ weights]]), np.ones(1)
+        mean, factor = mean.astype(np.float32), _cholesky(cov).T.astype(np.float32)
+    else:
+        history = returns.dropna().to_numpy(dtype=float)
+        if not len(history):
+            raise ValueError("No dates on which all held assets have returns to bootstrap from.")
+        if rebalance:
+            history, weights = history @ weights[:, None], np.ones(1)
+        history = history.astype(np.float32)
+
+    days = np.unique(np.r_[np.arange(0, horizon, record_every), horizon])
+    rng = np.random.default_rng(seed)
+    values = np.empty((num_paths, len(days)), dtype=np.float32)
+    values[:, 0] = initial_value
+    weights = weights.astype(np.float32)
+    chunk = max(1, max_chunk_elements // (horizon * len(weights)))
+    for lo in range(0, num_paths, chunk):
+        n = min(chunk, num_paths - lo)
+        if method == "normal":
+            draws = rng.standard_normal((n, horizon, len(weights)), dtype=np.float32) @ factor
+            draws += 1 + mean
+        else:
+            draws = history[_block_rows(rng, n, horizon, len(history), block_size)]
+            draws += 1
+        growth = np.cumprod(draws, axis=1, out=draws)[:, days[1:] - 1]
+        values[lo:lo + n, 1:] = initial_value * (growth @ weights)
+    return pd.DataFrame(values, columns=pd.Index(days, name="day"))
+
+def fan_chart(values, percentiles=PERCENTILES):
+    """
+    Percentiles of the portfolio value across paths for every day (rows) of the horizon.
+    """
+    bands = np.percentile(values.to_numpy(), percentiles, axis=0)
+    return pd.DataFrame(bands.T, index=values.columns, columns=[f"p{p}" for p in percentiles])
+
+def terminal_summary(values, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+    """
+    Quantiles of the terminal portfolio value, its mean and the probability of ending below the start.
+    """
+    terminal = values.iloc[:, -1].to_numpy(dtype=float)
+    summary = pd.Series(np.quantile(terminal, quantiles), index=[f"q{q:g}" for q in quantiles])
+    summary["mean"] = terminal.mean()
+    summary["prob_loss"] = np.mean(terminal < values.iloc[0, 0])
+    return summary
+
+def simulate(weights, daily_returns, horizon=252, num_paths=10000, method="normal", percentiles=PERCENTILES,
+             return_paths=False, **kwargs):
+    """
+    simulate_paths plus its summaries: a dict with the "fan" chart percentiles, the "terminal"
+    value summary and, with return_paths, the "paths" themselves.
+    """
+    values = simulate_paths(weights, daily_returns, horizon, num_paths, method, **kwargs)
+    result = {"fan": fan_chart(values, percentiles), "terminal": terminal_summary(values)}
+    if return_paths:
+        result["paths"] = values
+    return result
+
+cached_simulate = utils.memoize(simulate)
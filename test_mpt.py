@@ -1,6 +1,9 @@
 import utils
 import pandas as pd
 import numpy as np
+import threading
+import time
+import pytest
 
 def test_mpt():
     print("Testing MPT Utils...")
@@ -33,5 +36,622 @@ def test_mpt():
     except Exception as e:
         print(f"   ERROR in optimization: {e}")
 
+def make_prices(tickers, days=600, seed=0):
+    """
+    Synthetic business-day price history ending today, for offline tests.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=days)
+    rets = rng.normal(0.0005, 0.01, size=(days, len(tickers)))
+    return pd.DataFrame(100 * np.cumprod(1 + rets, axis=0), index=index, columns=tickers)
+
+
+def test_price_cache(tmp_path):
+    history = make_prices(["AAA", "BBB"])
+    calls = []
+
+    def downloader(tickers, period=None, start=None):
+        calls.append((tuple(tickers), period, start))
+        data = history[list(tickers)]
+        return data[data.index >= pd.Timestamp(start)] if start else data
+
+    cache = utils.PriceCache(cache_dir=str(tmp_path), downloader=downloader)
+    first = cache.get(["AAA", "BBB"], period="1y")
+    assert cache.stats["misses"] == 2 and len(calls) == 1
+
+    # Shorter period is sliced locally without touching the provider
+    second = cache.get(["AAA", "BBB"], period="6mo")
+    assert cache.stats["hits"] == 2 and len(calls) == 1
+    assert second.index[0] >= first.index[0] and second.index[-1] == first.index[-1]
+
+    # Stale entries only fetch the tail since the last cached date
+    cache.ttl = pd.Timedelta(0)
+    cache.get(["AAA", "BBB"], period="1y")
+    assert cache.stats["partial_hits"] == 2 and calls[-1][2] is not None
+
+    # A longer period than what was cached is a miss
+    cache.get(["AAA"], period="2y")
+    assert cache.stats["misses"] == 3
+
+
+def test_price_cache_concurrent_sessions(tmp_path):
+    history = make_prices(["AAA", "NEW"])
+    started, release, finished = threading.Event(), threading.Event(), threading.Event()
+
+    def downloader(tickers, period=None, start=None):
+        if "NEW" in tickers:
+            started.set()
+            release.wait(timeout=10)  # A slow cold download for another session
+            finished.set()
+        return history[list(tickers)]
+
+    cache = utils.PriceCache(cache_dir=str(tmp_path), downloader=downloader)
+    cache.get(["AAA"], period="1y")
+    cold = threading.Thread(target=cache.get, args=(["NEW"],), kwargs={"period": "1y"})
+    cold.start()
+    try:
+        assert started.wait(timeout=10)
+        cached = cache.get(["AAA"], period="1y")  # Served while the other download is still running
+        assert not finished.is_set() and list(cached.columns) == ["AAA"]
+    finally:
+        release.set()
+        cold.join()
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 2
+
+
+def test_generate_efficient_frontier_chunked():
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D"]))
+    mean, cov = utils.calculate_annualized_metrics(daily_returns)
+    results, weights = utils.generate_efficient_frontier(mean, cov, num_portfolios=1000, chunk_size=64, seed=1)
+    assert results.shape == (3, 1000) and weights.shape == (1000, 4)
+    assert np.allclose(weights.sum(axis=1), 1)
+    ret, vol = utils.portfolio_performance(weights[500], mean, cov)
+    assert np.isclose(results[1, 500], ret) and np.isclose(results[0, 500], vol)
+
+
+def test_critical_line_matches_slsqp():
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D", "E"], seed=3))
+    mean, cov = utils.calculate_annualized_metrics(daily_returns)
+    cla = utils.CriticalLineAlgorithm(mean, cov)
+
+    cla_returns, cla_vols = utils.calculate_efficient_frontier_line(mean, cov, num_points=10)
+    slsqp_returns, slsqp_vols = utils.calculate_efficient_frontier_line(mean, cov, num_points=10, method="slsqp")
+    assert np.isclose(cla_returns[-1], slsqp_returns[-1])
+    assert np.allclose(cla_vols[1:], slsqp_vols[1:], atol=1e-4)
+
+    max_sharpe, min_vol = utils.optimize_portfolio(mean, cov)
+    sharpe = lambda w: -utils.negative_sharpe_ratio(w, mean, cov)
+    assert sharpe(cla.max_sharpe()) >= sharpe(max_sharpe.x) - 1e-6
+    assert utils.portfolio_performance(cla.min_volatility(), mean, cov)[1] <= min_vol.fun + 1e-6
+
+
+def test_critical_line_tied_means():
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D"], seed=3))
+    _, cov = utils.calculate_annualized_metrics(daily_returns)
+    for tied in ([0.08, 0.1, 0.1, 0.02], [0.1, 0.1, 0.05, 0.1]):
+        mean = pd.Series(tied, index=cov.index)
+        _, min_vol = utils.optimize_portfolio(mean, cov)
+        cla_vol = utils.portfolio_performance(utils.CriticalLineAlgorithm(mean, cov).min_volatility(), mean, cov)[1]
+        assert np.isclose(cla_vol, min_vol.fun, atol=1e-6)
+        _, cla_vols = utils.calculate_efficient_frontier_line(mean, cov, num_points=8)
+        _, slsqp_vols = utils.calculate_efficient_frontier_line(mean, cov, num_points=8, method="slsqp")
+        # SLSQP struggles at the top target, where every tied asset has the maximum return
+        assert np.allclose(cla_vols[:-1], slsqp_vols[:-1], atol=1e-4) and cla_vols[-1] <= slsqp_vols[-1] + 1e-6
+
+    two = cov.iloc[:2, :2]
+    mean = pd.Series([0.1, 0.1], index=two.index)
+    _, min_vol = utils.optimize_portfolio(mean, two)
+    cla_vol = utils.portfolio_performance(utils.CriticalLineAlgorithm(mean, two).min_volatility(), mean, two)[1]
+    assert np.isclose(cla_vol, min_vol.fun, atol=1e-6)
+
+
+def test_analytic_gradients():
+    import scipy.optimize as sco
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D"], seed=4))
+    mean, cov = utils.calculate_annualized_metrics(daily_returns)
+    mean, cov = mean.values, cov.values
+    w = np.array([0.1, 0.2, 0.3, 0.4])
+    assert sco.check_grad(utils.negative_sharpe_ratio, utils.negative_sharpe_ratio_grad, w, mean, cov, 0.02) < 1e-4
+    assert sco.check_grad(utils.minimize_volatility_func, utils.minimize_volatility_grad, w, mean, cov) < 1e-4
+
+    counts = utils.compare_solver_evaluations(mean, cov)
+    analytic = counts[counts["Gradient"] == "analytic"]
+    finite = counts[counts["Gradient"] == "finite difference"]
+    assert (analytic["nfev"].values < finite["nfev"].values).all()
+    assert np.allclose(analytic["fun"].values, finite["fun"].values, atol=1e-4)
+
+
+def test_frontier_modes_agree():
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D", "E"], seed=5))
+    mean, cov = utils.calculate_annualized_metrics(daily_returns)
+    _, cold = utils.calculate_efficient_frontier_line(mean, cov, num_points=12, method="slsqp")
+    _, warm = utils.calculate_efficient_frontier_line(mean, cov, num_points=12, method="warm")
+    _, parallel = utils.calculate_efficient_frontier_line(mean, cov, num_points=12, method="parallel", max_workers=2)
+    assert np.allclose(cold, warm, atol=1e-4) and np.allclose(cold, parallel, atol=1e-4)
+
+    modes = utils.compare_frontier_modes(mean, cov, num_points=12, max_workers=2).set_index("Mode")
+    assert modes.loc["warm", "nit"] <= modes.loc["slsqp", "nit"]
+
+
+def test_max_sharpe_tangency_qp(monkeypatch):
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D", "E", "F"], seed=6))
+    mean, cov = utils.calculate_annualized_metrics(daily_returns)
+    max_sharpe, _ = utils.optimize_portfolio(mean, cov, 0.01)
+    slsqp, _ = utils.optimize_portfolio(mean, cov, 0.01, max_sharpe_method="slsqp")
+    assert max_sharpe.success and np.isclose(max_sharpe.x.sum(), 1) and max_sharpe.x.min() >= 0
+    assert max_sharpe.fun <= slsqp.fun + 1e-6
+    cla_weights = utils.CriticalLineAlgorithm(mean, cov).max_sharpe(0.01)
+    assert np.isclose(max_sharpe.fun, utils.negative_sharpe_ratio(cla_weights, mean, cov, 0.01))
+
+    # Hitting the iteration limit is reported, and optimize_portfolio falls back to SLSQP
+    capped = utils.max_sharpe_tangency(mean, cov, 0.01, max_iter=1)
+    assert not capped.success and capped.status == 1 and capped.nit == 1
+    assert not utils.min_volatility_qp(mean, cov, max_iter=1).success
+    tangency, min_volatility_qp = utils.max_sharpe_tangency, utils.min_volatility_qp
+    monkeypatch.setattr(utils, "max_sharpe_tangency", lambda *args, **kwargs: tangency(*args, **kwargs, max_iter=1))
+    monkeypatch.setattr(utils, "min_volatility_qp", lambda *args, **kwargs: min_volatility_qp(*args, **kwargs, max_iter=1))
+    fallback, fallback_min_vol = utils.optimize_portfolio(mean, cov, 0.01, min_vol_method="qp")
+    assert fallback.success and np.isclose(fallback.fun, slsqp.fun, atol=1e-6)
+    assert fallback_min_vol.success and "QP" not in fallback_min_vol.message
+
+
+def test_incremental_covariance():
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C"], seed=7))
+    stats = utils.IncrementalCovariance(daily_returns.columns)
+    for lo in range(0, 300, 50):
+        stats.update(daily_returns.iloc[lo:lo + 50])
+    stats.roll(daily_returns.iloc[300:400], daily_returns.iloc[:100])
+    mean, cov = stats.annualized_metrics()
+    expected_mean, expected_cov = utils.calculate_annualized_metrics(daily_returns.iloc[100:400])
+    assert np.allclose(mean, expected_mean) and np.allclose(cov, expected_cov)
+
+    decayed = utils.IncrementalCovariance.from_returns(daily_returns, decay=0.97)
+    w = 0.97 ** np.arange(len(daily_returns))[::-1]
+    x = daily_returns.values
+    m = w @ x / w.sum()
+    expected = (w[:, None] * (x - m)).T @ (x - m) / (w.sum() - (w**2).sum() / w.sum())
+    assert np.allclose(decayed.mean, m) and np.allclose(decayed.covariance(), expected)
+
+
+def test_backtest():
+    import backtest
+    prices = make_prices(["A", "B", "C", "D"], days=700, seed=8)
+    result = backtest.run_backtest(prices, window=252, frequency="M", transaction_cost=0.001)
+    equity, weights = result["equity"], result["weights"]
+    assert list(equity.columns) == list(backtest.STRATEGIES)
+    assert (result["drawdown"] <= 0).all().all()
+    assert np.allclose(weights["min_vol"].sum(axis=1), 1)
+
+    # Equal weight with no costs: first holding period matches buy-and-hold of the window start
+    first = weights["equal_weight"].index[0]
+    second = weights["equal_weight"].index[1]
+    daily_returns = utils.calculate_daily_returns(prices)
+    period = daily_returns.loc[first:second].iloc[:-1]
+    held = (np.cumprod(1 + period.values, axis=0) @ np.full(4, 0.25))[-1]
+    no_cost = backtest.run_backtest(prices, window=252, strategies=("equal_weight",))
+    assert np.isclose(no_cost["equity"]["equal_weight"].loc[period.index[-1]], held)
+
+
+def test_factor_covariance():
+    daily_returns = utils.calculate_daily_returns(make_prices([f"T{i}" for i in range(12)], seed=9))
+    mean, factor_cov = utils.calculate_annualized_metrics(daily_returns, n_factors=3)
+    dense = factor_cov.to_dense()
+    w = np.full(12, 1 / 12)
+    assert np.allclose(factor_cov @ w, dense @ w) and np.allclose(factor_cov.diagonal(), np.diag(dense))
+    assert np.allclose(factor_cov.solve(w[:5], np.arange(5)), np.linalg.solve(dense[:5, :5], w[:5]))
+
+    max_sharpe, min_vol = utils.optimize_portfolio(mean, factor_cov)
+    dense_sharpe, dense_min_vol = utils.optimize_portfolio(mean, dense, min_vol_method="qp")
+    assert np.allclose(max_sharpe.x, dense_sharpe.x) and np.allclose(min_vol.x, dense_min_vol.x)
+
+
+def test_result_cache():
+    calls = []
+
+    @utils.memoize
+    def metrics(daily_returns, risk_free_rate):
+        calls.append(risk_free_rate)
+        return utils.calculate_annualized_metrics(daily_returns)
+
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B"], seed=10))
+    metrics(daily_returns, 0.02)
+    metrics(daily_returns.copy(), 0.1 * 0.2)  # Same content and (rounded) rate: a hit
+    metrics(daily_returns, 0.03)
+    assert calls == [0.02, 0.03]
+
+    def same_name(tag, module):
+        def lookup(x):
+            return tag
+        lookup.__module__ = module
+        return utils.memoize(lookup)
+    assert same_name("one", "pages.one")(1) == "one" and same_name("two", "pages.two")(1) == "two"
+
+    cache = utils.ResultCache(max_bytes=3000)
+    for i in range(5):
+        cache.put(i, np.zeros(100))  # 800 bytes each
+    assert cache.get(0) is None and cache.get(4) is not None and cache.stats["evictions"] == 2
+    cache.ttl = pd.Timedelta(0)
+    assert cache.get(4) is None
+
+
+class StandInProvider:
+    """
+    Local stand-in for the price provider with injected latency and failures.
+    """
+
+    def __init__(self, history, latency=0.05, flaky_calls=0, bad=()):
+        self.history = history
+        self.latency = latency
+        self.flaky_calls = flaky_calls
+        self.bad = set(bad)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, tickers, period=None, start=None):
+        with self.lock:
+            self.calls += 1
+            fail = self.calls <= self.flaky_calls
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if fail:
+            raise ConnectionError("injected failure")
+        data = self.history.reindex(columns=list(tickers))
+        data[[t for t in tickers if t in self.bad]] = np.nan
+        return data
+
+
+def test_download_in_batches():
+    tickers = [f"T{i}" for i in range(20)]
+    provider = StandInProvider(make_prices(tickers[:-1]), latency=0.1, flaky_calls=2, bad=["T3"])
+    data, failed = utils.download_in_batches(tickers, provider, batch_size=4, max_workers=5, backoff=0.01)
+    assert provider.peak_in_flight > 1  # Batches overlap instead of running one after another
+    assert provider.calls == 7
+    assert set(failed) == {"T3", "T19"} and "T3" not in data.columns and data.shape[1] == 18
+
+    dead = StandInProvider(make_prices(tickers), latency=0, flaky_calls=100)
+    data, failed = utils.download_in_batches(tickers[:4], dead, retries=2, backoff=0.001)
+    assert data.empty and dead.calls == 3 and failed["T0"].startswith("ConnectionError")
+
+    bucket = utils.TokenBucket(rate=50, capacity=1)
+    start = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.perf_counter() - start >= 0.09
+
+
+def test_benchmark_suite():
+    import benchmark
+    returns = benchmark.synthetic_returns(6, 500, structure="constant", correlation=0.5)
+    corr = returns.corr().values[np.triu_indices(6, 1)]
+    assert abs(corr.mean() - 0.5) < 0.1
+
+    rows = benchmark.run_suite([(5, 250)], repeat=1, cases=["optimize_portfolio", "calculate_daily_returns"])
+    assert [r["case"] for r in rows] == ["calculate_daily_returns", "optimize_portfolio"]
+    assert rows[1]["iterations"] > 0
+    slower = [{**r, "seconds": r["seconds"] * 10 + 1} for r in rows]
+    assert len(benchmark.compare(slower, rows)) == 2 and not benchmark.compare(rows, rows)
+
+
+def test_perf_spans():
+    utils.start_perf_run()
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C"], seed=11))
+    with utils.perf_span("page step", note="x"):
+        mean, cov = utils.calculate_annualized_metrics(daily_returns)
+        utils.optimize_portfolio(mean, cov)
+    spans = utils.get_perf_spans()
+    assert [s["stage"] for s in spans] == ["returns", "page step", "metrics", "optimize"]
+    assert [s["depth"] for s in spans] == [0, 0, 1, 1]
+    assert spans[3]["nit"] > 0 and spans[1]["note"] == "x"
+    assert list(utils.perf_summary().columns[:2]) == ["stage", "ms"]
+
+
+def test_batch_optimize():
+    tickers = ["AAPL", "MSFT", "JPM", "XOM", "KO", "PG"]
+    daily_returns = utils.calculate_daily_returns(make_prices(tickers, days=800, seed=5))
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns)
+    subsets = {"Tech": ["AAPL", "MSFT", "NFLX"], "Defensive": ["KO", "PG", "XOM"], "All": tickers}
+    rates = [0.0, 0.02, 0.05]
+    table = utils.batch_optimize(mean_ret, cov_matrix, rates, subsets=subsets)
+    qp_table = utils.batch_optimize(mean_ret, cov_matrix, rates, subsets=subsets, method="qp")
+
+    assert len(table) == len(subsets) * len(rates) * 2
+    assert np.allclose(table["sharpe"], qp_table["sharpe"], atol=1e-6)
+    # Tickers outside a subset (or without data, like NFLX) get no weight
+    tech = table[table["subset"] == "Tech"]
+    assert "NFLX" not in table.columns and (tech[["JPM", "XOM", "KO", "PG"]] == 0).all().all()
+    assert np.allclose(table[tickers].sum(axis=1), 1)
+
+    for rf in rates:
+        row = table[(table["subset"] == "All") & (table["risk_free_rate"] == rf)].set_index("portfolio")
+        max_sharpe, min_vol = utils.optimize_portfolio(mean_ret, cov_matrix, rf, max_sharpe_method="slsqp")
+        assert row.loc["max_sharpe", "sharpe"] >= -max_sharpe.fun - 1e-6
+        assert row.loc["min_vol", "volatility"] <= min_vol.fun + 1e-6
+
+
+def test_batch_pipeline(tmp_path, monkeypatch):
+    import batch
+    provider = StandInProvider(make_prices(["AAA", "BBB", "CCC", "DDD"], days=400, seed=9), latency=0)
+    monkeypatch.setattr(utils, "_price_cache", utils.PriceCache(cache_dir=str(tmp_path / "prices"),
+                                                                 downloader=provider))
+    (tmp_path / "mine.txt").write_text("AAA, BBB  # comment\nCCC\n")
+    (tmp_path / "thin.txt").write_text("DDD ZZZ\n")
+    argv = ["--no-sectors", "--ticker-files", str(tmp_path / "mine.txt"), str(tmp_path / "thin.txt"),
+            "--periods", "1y", "--risk-free-rates", "0.01", "0.03", "--workers", "1",
+            "--output-dir", str(tmp_path / "out")]
+
+    assert batch.main(argv) == 0
+    metrics = pd.read_json(tmp_path / "out" / "portfolios.json")
+    weights = pd.read_json(tmp_path / "out" / "weights.json")
+    assert set(metrics["universe"]) == {"mine"} and len(metrics) == 4
+    assert np.allclose(weights.groupby(["risk_free_rate", "portfolio"])["weight"].sum(), 1)
+
+    # A restart skips completed jobs without refetching
+    calls = provider.calls
+    jobs = batch.build_jobs({"mine": ["AAA", "BBB", "CCC"], "thin": ["DDD", "ZZZ"]}, ["1y"], [0.01, 0.03])
+    statuses = batch.run_batch(jobs, str(tmp_path / "out"), max_workers=1)
+    assert (statuses["status"] == "done").all() and provider.calls == calls
+    assert batch.build_jobs({"mine": ["AAA"]}, ["1y"], [0.02])[0]["job_id"] != jobs[0]["job_id"]
+
+
+def test_chart_downsampling():
+    import charts
+    y = np.sin(np.linspace(0, 20, 10000))
+    y[5000] = 5.0
+    keep = charts.lttb_indices(np.arange(10000), y, 200)
+    assert len(keep) == 200 and keep[0] == 0 and keep[-1] == 9999 and 5000 in keep
+    assert np.all(np.diff(keep) > 0)
+
+    prices = make_prices([f"T{i}" for i in range(8)], days=5000, seed=3)
+    fig = charts.line_figure(prices, max_points=500)
+    assert [trace.type for trace in fig.data] == ["scattergl"] * 8 and len(fig.data[0].x) == 500
+    assert fig.data[0].x[-1] == prices.index[-1] and charts.payload_kb(fig) < 400
+
+    vol, ret = np.random.default_rng(0).uniform(0.1, 0.3, (2, 50000))
+    assert charts.frontier_cloud_trace(vol[:1000], ret[:1000], ret[:1000] / vol[:1000]).type == "scattergl"
+    density = charts.frontier_cloud_trace(vol, ret, ret / vol, bins=40)
+    assert density.type == "heatmap" and np.nansum(density.customdata) == 50000
+
+
+def test_lazy_imports():
+    import subprocess
+    import sys
+    import import_times
+    check = ("import sys, utils; assert 'yfinance' not in sys.modules and 'scipy.optimize' not in sys.modules; "
+             "utils.max_sharpe_tangency([0.1, 0.2], [[0.04, 0.0], [0.0, 0.09]]); assert 'scipy.optimize' in sys.modules")
+    assert subprocess.run([sys.executable, "-c", check], cwd=import_times.os.path.dirname(utils.__file__)).returncode == 0
+
+    report = import_times.measure(["utils"], repeat=1)
+    assert report[0]["modules_loaded"] > 1 and report[0]["heaviest"][0]["module"] == "pandas"
+    slower = [{**report[0], "ms": report[0]["ms"] * 2 + 50}]
+    assert import_times.compare(slower, report) and not import_times.compare(report, report)
+
+
+def test_security_master(tmp_path):
+    master = utils.get_security_master()
+    assert len(master) == 49 and master.tickers == sorted(master.tickers)
+    assert utils.get_stock_universe()["Energy"][0] == "XOM" and utils.get_ticker_name_mapping()["GS"] == "Goldman Sachs Group"
+
+    path = tmp_path / "listing.csv"
+    path.write_text("ticker,name,sector,exchange\nmsft,Microsoft Corporation,Tech,NASDAQ\nMS,Morgan Stanley,Finance,NYSE\n"
+                    "MSCI,MSCI Inc.,Finance,NYSE\nMSFT,Duplicate,Tech,NASDAQ\nMU,Micron Technology,,NASDAQ\n")
+    listing = utils.SecurityMaster.from_csv(str(path))
+    assert listing.tickers == ["MS", "MSCI", "MSFT", "MU"] and listing.name("MSFT") == "Microsoft Corporation"
+    assert listing.sectors == {"Tech": ["MSFT"], "Finance": ["MS", "MSCI"], "Other": ["MU"]}
+    assert [r["ticker"] for r in listing.search("ms")] == ["MS", "MSCI", "MSFT"]
+    assert [r["ticker"] for r in listing.search("micro")] == ["MU", "MSFT"]
+    assert [r["ticker"] for r in listing.search("morgan stan", fuzzy=False)] == ["MS"]
+    assert [r["ticker"] for r in listing.search("mircon")] == ["MU"] and listing.search("mircon", fuzzy=False) == []
+
+
+def test_returns_matrix():
+    prices = make_prices(["A", "B", "C", "D"], days=300, seed=4)
+    prices.iloc[50, 2] = np.nan
+    frame = utils.calculate_daily_returns(prices.dropna())
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(frame)
+
+    returns = utils.ReturnsMatrix.from_prices(prices.dropna())
+    assert returns.values.flags.c_contiguous and returns.index.equals(frame.index)
+    compact_mean, compact_cov = utils.calculate_annualized_metrics(returns)
+    assert np.allclose(compact_mean, mean_ret) and np.allclose(compact_cov, cov_matrix)
+
+    small = utils.ReturnsMatrix.from_prices(prices, dtype=np.float32)
+    assert small.values.dtype == np.float32 and len(small) == len(prices) - 3  # two returns touch the gap
+    assert np.allclose(small.cov(chunk_rows=7), small.to_frame().astype(float).cov(), rtol=1e-5)
+
+    window = returns.period(returns.index[10], returns.index[19])
+    assert len(window) == 10 and np.shares_memory(window.values, returns.values)
+    assert np.shares_memory(returns.select(["B", "C"]).values, returns.values)
+    picked = returns.select(["D", "A"])
+    assert list(picked.columns) == ["D", "A"] and np.allclose(picked.values, frame[["D", "A"]].values)
+    assert np.allclose(utils.IncrementalCovariance.from_returns(returns).covariance(), frame.cov())
+
+
+def test_pairwise_covariance(tmp_path, monkeypatch):
+    prices = make_prices(["OLD", "MID", "IPO"], days=500, seed=8)
+    prices.iloc[:400, 2] = np.nan  # listed 100 days ago
+    monkeypatch.setattr(utils, "_price_cache", utils.PriceCache(cache_dir=str(tmp_path),
+                                                                 downloader=StandInProvider(prices, latency=0)))
+    complete = utils.fetch_stock_data(["OLD", "MID", "IPO"], period="2y")
+    full = utils.fetch_stock_data(["OLD", "MID", "IPO"], period="2y", how="all")
+    assert len(complete) == 100 and len(full) == 500
+
+    daily_returns = utils.calculate_daily_returns(full)
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns)
+    assert np.allclose(cov_matrix, daily_returns.cov() * 252) and np.allclose(mean_ret, daily_returns.mean() * 252)
+    old_only = utils.calculate_annualized_metrics(utils.calculate_daily_returns(full[["OLD", "MID"]]))[1]
+    assert np.allclose(cov_matrix.loc[["OLD", "MID"], ["OLD", "MID"]], old_only)
+
+    mean, cov, counts = utils.pairwise_moments(daily_returns.to_numpy(), chunk_rows=64)
+    assert counts[0, 0] == 499 and counts[0, 2] == 99 and np.allclose(cov * 252, cov_matrix)
+    with monkeypatch.context() as patch:
+        patch.setattr(utils, "_pairwise_cross", None)  # Means alone must not build the covariance
+        assert np.allclose(utils.ReturnsMatrix.from_frame(daily_returns).mean(), mean)
+
+    # Disjoint histories give an indefinite pairwise estimate; the repair keeps the variances
+    bad = pd.DataFrame([[1.0, 0.9, -0.9], [0.9, 1.0, 0.9], [-0.9, 0.9, 1.0]]) * 0.04
+    fixed = utils.repair_psd(bad)
+    assert np.linalg.eigvalsh(fixed).min() > -1e-12 and np.allclose(np.diag(fixed), 0.04)
+    assert utils.repair_psd(cov_matrix) is cov_matrix
+
+    # A constant-price cash fund has zero variance: no correlations to repair, and no crash
+    cash = make_prices(["AAA", "CASH", "IPO"], days=500, seed=1)
+    cash["CASH"] = 1.0
+    cash.iloc[:200, 2] = np.nan
+    _, from_returns = utils.calculate_annualized_metrics(utils.calculate_daily_returns(cash))
+    _, from_statistics = utils.PortfolioStatistics.from_prices(cash).annualized_metrics()
+    for cov in (from_returns, from_statistics):
+        assert (cov["CASH"] == 0).all() and (cov.loc["CASH"] == 0).all()
+        assert np.isclose(cov.loc["IPO", "IPO"], from_statistics.loc["IPO", "IPO"])
+
+
+def test_forward_simulation():
+    import simulation
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C"], days=1000, seed=6))
+    weights = np.array([0.5, 0.0, 0.5])
+    paths = simulation.simulate_paths(weights, daily_returns, horizon=60, num_paths=4000, seed=1)
+    chunked = simulation.simulate_paths(weights, daily_returns, horizon=60, num_paths=4000, seed=1,
+                                        max_chunk_elements=1000)
+    assert paths.shape == (4000, 61) and np.allclose(paths, chunked) and (paths[0] == 1).all()
+
+    # Constant-mix normal paths compound the portfolio's daily mean and variance
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns)
+    rebalanced = simulation.simulate_paths(weights, daily_returns, horizon=60, num_paths=20000, rebalance=True, seed=2)
+    log_growth = np.log(rebalanced[60].to_numpy(dtype=float))
+    assert abs(log_growth.std() - np.sqrt(60 * weights @ cov_matrix.values @ weights / 252)) < 0.002
+
+    boot = simulation.simulate_paths(weights, daily_returns, horizon=20, num_paths=50, method="bootstrap",
+                                     rebalance=True, record_every=20, seed=3)
+    first_day = simulation.simulate_paths(weights, daily_returns, horizon=1, num_paths=50, method="bootstrap",
+                                          rebalance=True, seed=3)
+    distance = np.abs(first_day[1].to_numpy()[:, None] - 1 - daily_returns.values @ weights).min(axis=1)
+    assert list(boot.columns) == [0, 20] and distance.max() < 1e-6
+
+    result = simulation.simulate(weights, daily_returns, horizon=60, num_paths=2000, seed=4)
+    assert list(result["fan"].columns) == ["p5", "p25", "p50", "p75", "p95"] and len(result["fan"]) == 61
+    assert (result["fan"].diff(axis=1).iloc[1:, 1:] > 0).all().all()
+    assert 0 <= result["terminal"]["prob_loss"] <= 1 and "paths" not in result
+
+
+def test_risk_measures():
+    import risk
+    daily_returns = utils.calculate_daily_returns(make_prices(["A", "B", "C", "D"], days=801, seed=7))
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(daily_returns)
+    weights = np.random.default_rng(0).dirichlet(np.ones(4), size=50)
+
+    var, cvar = risk.historical_var_cvar(weights, daily_returns, chunk_size=16)
+    losses = np.sort(-(daily_returns.values @ weights.T), axis=0)[::-1]
+    tail = 40
+    assert np.allclose(var, losses[tail - 1]) and np.allclose(cvar, losses[:tail].mean(axis=0))
+    norm_var, norm_cvar = risk.parametric_var_cvar(weights, mean_ret, cov_matrix)
+    assert (norm_cvar > norm_var).all() and np.corrcoef(norm_var, var)[0, 1] > 0.9
+
+    # With a whole number of tail days (5% of 800) the LP optimum is exactly the historical CVaR
+    best = risk.minimize_cvar(daily_returns)
+    assert np.isclose(best.x.sum(), 1) and (best.x >= 0).all()
+    assert np.isclose(best.fun, risk.historical_var_cvar(best.x, daily_returns)[1][0])
+    assert best.fun <= cvar.min() + 1e-9
+    target = float(mean_ret.max() * 0.9)
+    constrained = risk.minimize_cvar(daily_returns, target_return=target)
+    assert constrained.x @ mean_ret.values >= target - 1e-6 and constrained.fun >= best.fun - 1e-9
+
+    disjoint = daily_returns.copy()
+    disjoint.iloc[:400, 0] = disjoint.iloc[400:, 1] = np.nan  # No date with every asset
+    with pytest.raises(ValueError):
+        risk.minimize_cvar(disjoint)
+    with pytest.raises(ValueError):
+        risk.historical_var_cvar(weights, disjoint)
+
+
+def test_portfolio_statistics():
+    prices = make_prices(["A", "B", "C", "D", "E"], days=500, seed=8)
+    prices.iloc[:300, 3] = np.nan  # D listed late
+    prices.iloc[:490, 4] = np.nan  # E overlaps too little to estimate its correlations
+    fetched = []
+
+    def fetch(tickers, period, how):
+        fetched.append(list(tickers))
+        return prices[[t for t in tickers if t in prices]]
+
+    stats = utils.PortfolioStatistics().select(["A", "B", "D"], fetch=fetch)
+    stats.select(["D", "A", "B", "C", "E", "ZZZ"], fetch=fetch).select(["D", "A", "B", "C", "E", "ZZZ"], fetch=fetch)
+    assert fetched == [["A", "B", "D"], ["C", "E", "ZZZ"]] and list(stats.missing) == ["ZZZ"]
+    stats.missing_ttl = pd.Timedelta(0)  # Missing tickers are retried once their entry expires
+    stats.select(["D", "A", "B", "C", "E", "ZZZ"], fetch=fetch)
+    assert fetched[-1] == ["ZZZ"] and list(stats.missing) == ["ZZZ"]
+    mean_ret, cov_matrix = stats.annualized_metrics()
+    full_mean, full_cov = utils.calculate_annualized_metrics(utils.calculate_daily_returns(prices[stats.tickers]))
+    assert list(cov_matrix.index) == ["D", "A", "B", "C", "E"]
+    assert np.allclose(mean_ret, full_mean) and np.allclose(cov_matrix, full_cov)
+
+    stats.select(["A", "C"], fetch=fetch)
+    mean_ret, cov_matrix = stats.annualized_metrics()
+    full_mean, full_cov = utils.calculate_annualized_metrics(utils.calculate_daily_returns(prices[["A", "C"]]))
+    assert len(fetched) == 3 and len(stats.daily_returns) == 499
+    assert np.allclose(mean_ret, full_mean) and np.allclose(cov_matrix, full_cov)
+
+
+def test_analytics_context():
+    prices = make_prices(["A", "B", "C"], seed=12)
+    prices.iloc[:100, 2] = np.nan
+    utils.start_perf_run()
+    analytics = utils.AnalyticsContext(prices)
+    for _ in range(2):
+        correlation, volatility, normalized = analytics.correlation, analytics.volatility, analytics.normalized_prices
+        analytics.mean_returns, analytics.cov_matrix
+    assert [s["stage"] for s in utils.get_perf_spans()] == ["returns", "metrics"]
+    assert np.allclose(volatility, analytics.returns.std() * np.sqrt(252))
+    assert np.allclose(correlation, analytics.returns.corr(), atol=0.02) and np.allclose(np.diagonal(correlation), 1)
+    assert np.allclose(normalized.bfill().iloc[0], 100)
+    ret, vol = analytics.performance([0.5, 0.5, 0.0])
+    assert np.allclose([ret, vol], utils.portfolio_performance(np.array([0.5, 0.5, 0.0]), analytics.mean_returns,
+                                                               analytics.cov_matrix))
+    assert analytics.performance(np.eye(3))[1].shape == (3,)
+
+    # Seeded from PortfolioStatistics, nothing is estimated again
+    stats = utils.PortfolioStatistics.from_prices(prices)
+    utils.start_perf_run()
+    seeded = stats.context()
+    assert np.allclose(seeded.correlation, correlation) and np.allclose(seeded.mean_returns, analytics.mean_returns)
+    assert not utils.get_perf_spans()
+
+
+def test_constrained_optimizer():
+    import constrained
+    tickers = ["A", "B", "C", "D", "E", "F"]
+    mean_ret, cov_matrix = utils.calculate_annualized_metrics(
+        utils.calculate_daily_returns(make_prices(tickers, days=800, seed=9)))
+    mean_ret += np.linspace(0.05, 0.3, 6)  # a spread of returns, so the constraints bind
+    max_sharpe, min_vol = utils.optimize_portfolio(mean_ret, cov_matrix, min_vol_method="qp")
+    for objective, expected in (("max_sharpe", max_sharpe), ("min_vol", min_vol)):
+        result = constrained.optimize_constrained(mean_ret, cov_matrix, objective)
+        assert np.allclose(result.x, expected.x, atol=1e-5) and np.isclose(result.fun, expected.fun, rtol=1e-5)
+
+    sectors = {"Tech": ["A", "B", "F"], "Energy": ["C"]}
+    names, members = constrained.sector_matrix(tickers, sectors)
+    assert names == ["Tech", "Energy", "Other"] and members.nnz == 6
+    result = constrained.optimize_constrained(mean_ret, cov_matrix, "max_sharpe", asset_bounds={"E": (0.1, 0.3)},
+                                              sectors=sectors, sector_bounds={"Tech": (None, 0.4), "Energy": (0.2, None)},
+                                              current_weights=min_vol.x, max_turnover=1.0, max_assets=4)
+    w = pd.Series(result.x, index=tickers)
+    assert np.isclose(w.sum(), 1) and (w > -1e-9).all() and 0.1 - 1e-6 <= w["E"] <= 0.3 + 1e-6
+    assert w[sectors["Tech"]].sum() <= 0.4 + 1e-6 and w["C"] >= 0.2 - 1e-6
+    assert np.abs(w - min_vol.x).sum() <= 1.0 + 1e-6 and (w > 1e-6).sum() <= 4
+    assert -result.fun < -max_sharpe.fun
+    tight = constrained.optimize_constrained(mean_ret, cov_matrix, "max_sharpe", current_weights=min_vol.x,
+                                             max_turnover=0.2)
+    assert np.isclose(np.abs(tight.x - min_vol.x).sum(), 0.2, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        constrained.optimize_constrained(mean_ret, cov_matrix, "min_vol", sectors=sectors,
+                                         sector_bounds={"Tech": (0.7, None), "Energy": (0.5, None)})
+    with pytest.raises(ValueError):
+        constrained.optimize_constrained(mean_ret, cov_matrix, "min_vol", asset_bounds=(0, 0.3), max_assets=3)
+
+
 if __name__ == "__main__":
     test_mpt()